@@ -11,4 +11,49 @@ MODEL_API_KEY = os.getenv("AZURE_OPENAI_API_KEY", "")
 API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2023-03-15-preview")
 MODEL_EMBED = "text-embedding-ada-002"
 MODEL_GENERATE = "gpt-3.5-turbo"
-MODEL_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT", "")
\ No newline at end of file
+MODEL_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT", "")
+
+# Shared FAISS index state (one directory per user, visible to every worker)
+INDEX_DIR = os.getenv("INDEX_DIR", "./indices")
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+# Rebuild a user's index once this fraction of its vectors belongs to deleted documents
+INDEX_COMPACT_THRESHOLD = float(os.getenv("INDEX_COMPACT_THRESHOLD", "0.2"))
+
+# Index codes: "flat" (float32), "fp16", "int8" or "pq". Compressed codes can be
+# re-ranked exactly over INDEX_RERANK_FACTOR * k candidates (0 disables re-ranking).
+INDEX_QUANTIZATION = os.getenv("INDEX_QUANTIZATION", "flat")
+INDEX_RERANK_FACTOR = int(os.getenv("INDEX_RERANK_FACTOR", "0"))
+INDEX_PQ_M = int(os.getenv("INDEX_PQ_M", "96"))
+
+# Bulk ingest: inputs per embedding request and extraction processes (defaults to CPU count)
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "16"))
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "0")) or None
+# Limits on a single bulk upload after zip archives are expanded
+UPLOAD_MAX_FILES = int(os.getenv("UPLOAD_MAX_FILES", "1000"))
+UPLOAD_MAX_UNCOMPRESSED_BYTES = int(os.getenv("UPLOAD_MAX_UNCOMPRESSED_BYTES", str(512 * 1024 * 1024)))
+
+# Process role: "all", "api" (auth/chat only) or "ingest" (auth/upload only)
+PROCESS_ROLE = os.getenv("PROCESS_ROLE", "all")
+# Comma-separated startup hooks from app.startup.PREWARM_HOOKS, e.g. "faiss,extractors"
+PREWARM = [name.strip() for name in os.getenv("PREWARM", "").split(",") if name.strip()]
+
+# Outbound OpenAI scheduling: deployment quota, concurrent calls, and the share
+# of the quota background work (ingest) must leave for interactive chat
+OPENAI_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", "240000"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+OPENAI_INTERACTIVE_RESERVE = float(os.getenv("OPENAI_INTERACTIVE_RESERVE", "0.2"))
+# Concurrent calls background work may never take, so chat doesn't queue behind embeddings
+OPENAI_INTERACTIVE_SLOTS = int(os.getenv("OPENAI_INTERACTIVE_SLOTS", "1"))
+# Where the token bucket is shared between all workers and process roles (a flock'd file).
+# It must be on storage every process can see, like INDEX_DIR; set it to "" to keep one
+# bucket per process, in which case each process needs its own slice of the quota in
+# OPENAI_TOKENS_PER_MINUTE (deployment quota / number of processes).
+SCHEDULER_STATE_DIR = os.getenv("SCHEDULER_STATE_DIR", INDEX_DIR)
+
+# Write-behind chat message persistence: flush after this many seconds or messages
+MESSAGE_FLUSH_INTERVAL = float(os.getenv("MESSAGE_FLUSH_INTERVAL", "0.05"))
+MESSAGE_FLUSH_BATCH = int(os.getenv("MESSAGE_FLUSH_BATCH", "100"))
+# send_message waits this long for its messages to commit, so every worker can read them
+MESSAGE_WRITE_TIMEOUT = float(os.getenv("MESSAGE_WRITE_TIMEOUT", "5"))
+# Messages the database rejects (or that are unwritten at shutdown) are appended here as JSON lines
+MESSAGE_DEAD_LETTER_PATH = os.getenv("MESSAGE_DEAD_LETTER_PATH", "./chat_dead_letters.jsonl")
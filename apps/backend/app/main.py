@@ -1,29 +1,67 @@
 # app/main.py
 
+import time
+_import_start = time.perf_counter()
+
+import importlib
+import sys
 import uvicorn
 from fastapi import FastAPI
 
+from .config import WORKERS, PROCESS_ROLE, PREWARM
 from .database import Base, engine
-from .routers import auth, chat, upload, ask_question  # your route files
+from .startup import ROUTERS, ROLE_ROUTERS, StartupReport, run_prewarm, logger
+from .services.request_scheduler import shutdown_scheduler
+from .services.message_log import close_message_log
 
 # Make sure models are imported, so SQLAlchemy can see them
 from .models import user, chat_session, chat_message, document
 
-def create_app() -> FastAPI:
+def create_app(role: str = PROCESS_ROLE) -> FastAPI:
+    if role not in ROLE_ROUTERS:
+        raise ValueError(f"Unknown PROCESS_ROLE '{role}', expected one of {sorted(ROLE_ROUTERS)}")
+
     app = FastAPI(title="My ChatGPT-like Backend")
+    report = StartupReport(role)
+    report.phases.append(("import", time.perf_counter() - _import_start))
+    app.state.startup_report = report
+
+    # Include routers; only the ones this role serves are ever imported
+    for name in ROLE_ROUTERS[role]:
+        module = report.timed(f"router:{name}", importlib.import_module, f".routers.{name}", __package__)
+        app.include_router(module.router, prefix=ROUTERS[name], tags=[ROUTERS[name].strip("/")])
+
+    @app.on_event("startup")
+    def on_startup():
+        # Create tables at startup rather than import time
+        report.timed("create_all", Base.metadata.create_all, bind=engine)
+        # create_all skips existing tables, so check older databases for the chat search index here
+        with engine.begin() as connection:
+            if not report.timed("search_index", chat_message.ensure_search_index, connection):
+                logger.warning("No chat search index for %s (see app.search_migration); "
+                               "search falls back to substring matching", engine.dialect.name)
+        run_prewarm(report, PREWARM)
+        report.log()
 
-    # Create tables
-    Base.metadata.create_all(bind=engine)
+    @app.on_event("shutdown")
+    def on_shutdown():
+        # Let already-queued OpenAI calls finish, then write out pending chat messages
+        shutdown_scheduler()
+        close_message_log()
+        # Only ingest processes ever load file_service; don't import it just to shut it down
+        file_service = sys.modules.get(f"{__package__}.services.file_service")
+        if file_service is not None:
+            file_service.shutdown_extract_pool()
 
-    # Include routers
-    app.include_router(auth.router, prefix="/auth", tags=["auth"])
-    app.include_router(chat.router, prefix="/chat", tags=["chat"])
-    app.include_router(upload.router, prefix="/upload", tags=["upload"])
-    app.include_router(ask_question.router, prefix="/ask", tags=["ask"])
+    @app.get("/startup_report", tags=["ops"])
+    def startup_report():
+        return report.as_dict()
 
     return app
 
 app = create_app()
 
 if __name__ == "__main__":
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    # Index state lives in INDEX_DIR, so any number of workers see the same documents.
+    # uvicorn can't reload with multiple workers, so reload only in single-process dev mode.
+    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, workers=WORKERS, reload=WORKERS == 1)
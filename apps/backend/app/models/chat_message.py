@@ -1,6 +1,6 @@
 # app/models/chat_message.py
 
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, event
 from datetime import datetime
 from sqlalchemy.orm import relationship
 from ..database import Base
@@ -15,4 +15,95 @@ class ChatMessage(Base):
     content = Column(Text)
     timestamp = Column(DateTime, default=datetime.utcnow)
 
-    session = relationship("ChatSession", backref="messages")
\ No newline at end of file
+    session = relationship("ChatSession", backref="messages")
+
+# Full-text index over `content`, maintained incrementally by the database.
+# On SQLite it is an FTS5 table kept in sync by triggers. It also carries
+# the owning user's id as an indexed token, so a search intersects with that
+# user's postings and only ranks their rows. chat_messages has no user_id,
+# so the table stores its own copy of the content instead of using
+# external content.
+# On Postgres it is a stored generated tsvector column, GIN-indexed together
+# with session_id (btree_gin), so a search only reads the postings of the
+# user's sessions and ranks on the stored vector. Adding the column to an
+# existing table rewrites it, so there it is built once by a migration
+# (app.search_migration), never on a worker's startup.
+SQLITE_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts
+       USING fts5(content, user_id, session_id UNINDEXED)""",
+    """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_insert AFTER INSERT ON chat_messages BEGIN
+         INSERT INTO chat_messages_fts(rowid, content, user_id, session_id)
+         SELECT new.id, new.content, s.user_id, new.session_id FROM chat_sessions s WHERE s.id = new.session_id;
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_delete AFTER DELETE ON chat_messages BEGIN
+         DELETE FROM chat_messages_fts WHERE rowid = old.id;
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_update AFTER UPDATE OF content ON chat_messages BEGIN
+         UPDATE chat_messages_fts SET content = new.content WHERE rowid = new.id;
+       END""",
+]
+SQLITE_FTS_BACKFILL = """
+    INSERT INTO chat_messages_fts(rowid, content, user_id, session_id)
+    SELECT m.id, m.content, s.user_id, m.session_id
+    FROM chat_messages m JOIN chat_sessions s ON s.id = m.session_id
+"""
+POSTGRES_FTS_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS btree_gin",
+    """ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS search_vector tsvector
+       GENERATED ALWAYS AS (to_tsvector('english', coalesce(content, ''))) STORED""",
+    """CREATE INDEX {concurrently} IF NOT EXISTS ix_chat_messages_search
+       ON chat_messages USING GIN (session_id, search_vector)""",
+]
+
+def _create_sqlite_search_index(connection):
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE name = 'chat_messages_fts'"
+    ).first()
+    for statement in SQLITE_FTS_DDL:
+        connection.exec_driver_sql(statement)
+    if not exists:
+        connection.exec_driver_sql(SQLITE_FTS_BACKFILL)
+
+def postgres_search_ready(connection) -> bool:
+    """Whether the Postgres search column exists, i.e. the migration has run."""
+    return connection.exec_driver_sql(
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_name = 'chat_messages' AND column_name = 'search_vector'"
+    ).first() is not None
+
+def create_search_index(target, connection, **kw):
+    """after_create hook: chat_messages is new and empty, so every dialect builds its index right away."""
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        _create_sqlite_search_index(connection)
+    elif dialect == "postgresql":
+        for statement in POSTGRES_FTS_DDL:
+            connection.exec_driver_sql(statement.format(concurrently=""))
+
+def ensure_search_index(connection) -> bool:
+    """
+    Startup check for tables that predate the search index. SQLite adds (and
+    backfills) it here. Postgres only reports whether the migration has run.
+    Returns False if search has to fall back to substring matching.
+    """
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        _create_sqlite_search_index(connection)
+        return True
+    if dialect == "postgresql":
+        return postgres_search_ready(connection)
+    return False
+
+def migrate_search_index(engine):
+    """Builds the Postgres search index on an existing table. CONCURRENTLY can't run inside a transaction."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        for statement in POSTGRES_FTS_DDL:
+            connection.exec_driver_sql(statement.format(concurrently="CONCURRENTLY"))
+
+def drop_search_index(target, connection, **kw):
+    # The triggers go with chat_messages; the FTS table has to be dropped explicitly
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql("DROP TABLE IF EXISTS chat_messages_fts")
+
+event.listen(ChatMessage.__table__, "after_create", create_search_index)
+event.listen(ChatMessage.__table__, "before_drop", drop_search_index)
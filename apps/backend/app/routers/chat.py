@@ -1,14 +1,20 @@
 # app/routers/chat.py
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from ..database import get_db
 from ..models.chat_session import ChatSession
 from ..models.chat_message import ChatMessage
 from ..schemas.chat_schemas import ChatRequest
-from ..config import SECRET_KEY
+from ..config import SECRET_KEY, MESSAGE_WRITE_TIMEOUT
 from .auth import get_current_user
-import openai, os
+from ..services.request_scheduler import get_scheduler, estimate_tokens, INTERACTIVE
+from ..services.message_log import get_message_log
+from ..services.chat_search import search_messages
+import logging
+import os
+
+logger = logging.getLogger("uvicorn.error")
 
 router = APIRouter()
 
@@ -40,7 +46,14 @@ def get_chat_messages(session_id: int, db: Session = Depends(get_db), current_us
     if not chat_session:
         raise HTTPException(status_code=404, detail="Chat session not found")
 
+    # send_message returns once its messages are committed, so other workers' messages are
+    # in the DB; this worker's queue only matters if that wait timed out. Snapshot it before
+    # reading the DB: anything that commits in between shows up in both and is de-duplicated
+    pending = get_message_log().pending_for_session(session_id)
     messages = db.query(ChatMessage).filter(ChatMessage.session_id == session_id).order_by(ChatMessage.timestamp).all()
+    stored = {(m.timestamp, m.role, m.content) for m in messages}
+    messages += [m for m in pending if (m.timestamp, m.role, m.content) not in stored]
+    messages.sort(key=lambda m: m.timestamp)
     return [
         {
             "role": m.role,
@@ -49,6 +62,17 @@ def get_chat_messages(session_id: int, db: Session = Depends(get_db), current_us
         } for m in messages
     ]
 
+@router.get("/search")
+def search_chat_history(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user)
+):
+    results = search_messages(db, current_user.id, q, limit=limit, offset=offset)
+    return {"query": q, "limit": limit, "offset": offset, "results": results}
+
 @router.post("/send_message")
 def send_message_to_chat(req: ChatRequest, db: Session = Depends(get_db), current_user=Depends(get_current_user)):
     if req.session_id is None:
@@ -61,32 +85,38 @@ def send_message_to_chat(req: ChatRequest, db: Session = Depends(get_db), curren
     if not chat_session:
         raise HTTPException(status_code=404, detail="Chat session not found")
 
-    # Save user message
-    user_msg = ChatMessage(session_id=chat_session.id, role="user", content=req.message)
-    db.add(user_msg)
-    db.commit()
-    db.refresh(user_msg)
+    # Save user message; written behind while the model is called
+    message_log = get_message_log()
+    message_log.append(chat_session.id, "user", req.message)
 
     # Call OpenAI or Azure
+    import openai
     openai.api_key = os.getenv("OPENAI_API_KEY", "")
     try:
-        response = openai.ChatCompletion.create(
-            model=req.model_name,
-            messages=[
-                {"role": "system", "content": "You are a helpful AI assistant."},
-                {"role": "user", "content": req.message},
-            ],
-            max_tokens=100,
-            temperature=0.7
-        )
+        # Interactive priority: goes ahead of any queued ingest work
+        response = get_scheduler().submit(
+            lambda: openai.ChatCompletion.create(
+                model=req.model_name,
+                messages=[
+                    {"role": "system", "content": "You are a helpful AI assistant."},
+                    {"role": "user", "content": req.message},
+                ],
+                max_tokens=100,
+                temperature=0.7
+            ),
+            estimate_tokens(req.message) + 100,
+            INTERACTIVE
+        ).result()
         assistant_content = response["choices"][0]["message"]["content"]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"OpenAI error: {e}")
 
-    # Save assistant response
-    assistant_msg = ChatMessage(session_id=chat_session.id, role="assistant", content=assistant_content)
-    db.add(assistant_msg)
-    db.commit()
+    # Save assistant response. Requests may land on any worker, so wait for both messages to be
+    # committed (batched with other requests' writes) before answering
+    assistant_message = message_log.append(chat_session.id, "assistant", assistant_content)
+    if not message_log.wait_until_written(assistant_message, timeout=MESSAGE_WRITE_TIMEOUT):
+        logger.warning("Messages for chat session %s not committed after %ss; other workers won't see them yet",
+                       chat_session.id, MESSAGE_WRITE_TIMEOUT)
     return {"assistant_response": assistant_content}
 
 @router.get("/stream_chat")
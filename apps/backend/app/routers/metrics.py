@@ -0,0 +1,17 @@
+# app/routers/metrics.py
+
+from fastapi import APIRouter
+from ..services.request_scheduler import get_scheduler
+from ..services.message_log import get_message_log
+
+router = APIRouter()
+
+@router.get("/scheduler")
+def scheduler_metrics():
+    """Queue depth, quota and dispatch counters of the outbound OpenAI scheduler."""
+    return get_scheduler().metrics()
+
+@router.get("/message_log")
+def message_log_metrics():
+    """Queued chat messages and dead letters of the write-behind message log."""
+    return get_message_log().metrics()
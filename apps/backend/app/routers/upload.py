@@ -1,18 +1,50 @@
 # app/routers/upload.py
 
+import io
+import os
+import zipfile
+from typing import List
+import numpy as np
 from fastapi import APIRouter, Depends, File, UploadFile, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from ..database import get_db
-from ..schemas.chat_schemas import FileUploadResponse
+from ..schemas.chat_schemas import FileUploadResponse, BulkUploadResponse, DocumentDeleteResponse
 from .auth import get_current_user
 from ..models.document import Document
-from ..services.file_service import FileService
+from ..services.file_service import FileService, SUPPORTED_FORMATS, file_extension
 from ..services.embeddings_manager import EmbeddingsManager
 from ..services.openai_client import OpenAIClient
-from ..config import (MODEL_API_KEY, API_VERSION, MODEL_GENERATE, MODEL_EMBED, MODEL_ENDPOINT)
+from ..services.request_scheduler import get_scheduler, ScheduledOpenAIClient, SchedulerEmbeddings, BACKGROUND
+from ..config import (MODEL_API_KEY, API_VERSION, MODEL_GENERATE, MODEL_EMBED, MODEL_ENDPOINT, INDEX_DIR,
+                      INDEX_COMPACT_THRESHOLD, INDEX_QUANTIZATION, INDEX_RERANK_FACTOR, INDEX_PQ_M,
+                      EMBED_BATCH_SIZE, UPLOAD_MAX_FILES, UPLOAD_MAX_UNCOMPRESSED_BYTES)
 
 router = APIRouter()
 
+model_config = type("Config", (), dict(
+    MODEL_API_KEY=MODEL_API_KEY,
+    API_VERSION=API_VERSION,
+    MODEL_GENERATE=MODEL_GENERATE,
+    MODEL_EMBED=MODEL_EMBED,
+    MODEL_ENDPOINT=MODEL_ENDPOINT
+))
+
+# One manager per process; state is shared with other workers through INDEX_DIR
+embeddings_manager = EmbeddingsManager(
+    index_dir=INDEX_DIR,
+    compact_threshold=INDEX_COMPACT_THRESHOLD,
+    quantization=INDEX_QUANTIZATION,
+    rerank_factor=INDEX_RERANK_FACTOR,
+    pq_m=INDEX_PQ_M
+)
+
+def _ingest_file_service() -> FileService:
+    # Ingest is background work for the scheduler, so interactive chat keeps its share of the quota
+    scheduler = get_scheduler()
+    openai_client = ScheduledOpenAIClient(OpenAIClient(config=model_config), scheduler, BACKGROUND)
+    return FileService(openai_client, model_config, embeddings_manager, embeddings=SchedulerEmbeddings(scheduler, BACKGROUND))
+
 @router.post("/", response_model=FileUploadResponse)
 async def upload_document(
     file: UploadFile = File(...),
@@ -21,29 +53,150 @@ async def upload_document(
 ):
     content = await file.read()
 
-    # Use your FileService to process & embed
-    # Usually you'd keep a single instance around, but for example:
-    openai_client = OpenAIClient(config=type("Config", (), dict(
-        MODEL_API_KEY=MODEL_API_KEY,
-        API_VERSION=API_VERSION,
-        MODEL_GENERATE=MODEL_GENERATE,
-        MODEL_EMBED=MODEL_EMBED,
-        MODEL_ENDPOINT=MODEL_ENDPOINT
-    )))
-
-    embeddings_manager = EmbeddingsManager()
-    file_service = FileService(openai_client, None, embeddings_manager)
-
-    file_service.process_file_for_user(str(current_user.id), content, file.filename)
+    # Extract, chunk and embed before touching the database: the flush below opens a write
+    # transaction, and on SQLite that locks out every other writer until the commit.
+    # Building the service imports LangChain, and the embedding calls wait on the
+    # scheduler at background priority, so both stay off the event loop
+    chunks, chunk_embeddings = await run_in_threadpool(
+        lambda: _ingest_file_service().embed_file(content, file.filename)
+    )
 
-    # Then store in DB if needed
+    # The flush assigns the document id the chunk vectors are tagged with
     new_doc = Document(
         user_id=current_user.id,
         filename=file.filename,
         text_content="(raw text or omitted for large docs...)"
     )
     db.add(new_doc)
+    db.flush()
+
+    if chunks:
+        await run_in_threadpool(
+            embeddings_manager.add_embeddings_for_user,
+            str(current_user.id), chunk_embeddings, chunks, document_id=new_doc.id
+        )
+
     db.commit()
     db.refresh(new_doc)
 
-    return {"msg": "File uploaded", "document_id": new_doc.id}
\ No newline at end of file
+    return {"msg": "File uploaded", "document_id": new_doc.id}
+
+def _expand_uploads(uploads: list[tuple[bytes, str]]) -> tuple[list[tuple[bytes, str]], list[str]]:
+    """
+    Zip uploads become one entry per file inside them; anything else is passed through.
+    Files in a format we can't extract are not read and come back as `skipped` names.
+    Entry count and uncompressed size are checked against the limits from the zip
+    directory before anything is decompressed, so a zip bomb is rejected up front.
+    """
+    entries = []
+    skipped = []
+    total_bytes = 0
+
+    def check_limits(n_files: int):
+        if n_files > UPLOAD_MAX_FILES:
+            raise HTTPException(status_code=413, detail=f"Too many files (limit {UPLOAD_MAX_FILES})")
+        if total_bytes > UPLOAD_MAX_UNCOMPRESSED_BYTES:
+            raise HTTPException(status_code=413, detail=f"Upload too large (limit {UPLOAD_MAX_UNCOMPRESSED_BYTES} bytes)")
+
+    for content, file_name in uploads:
+        if not file_name.lower().endswith(".zip"):
+            if file_extension(file_name) in SUPPORTED_FORMATS:
+                entries.append((content, file_name))
+                total_bytes += len(content)
+            else:
+                skipped.append(file_name)
+            check_limits(len(entries) + len(skipped))
+            continue
+        try:
+            archive = zipfile.ZipFile(io.BytesIO(content))
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail=f"Invalid zip archive: {file_name}")
+        with archive:
+            members = []
+            for info in archive.infolist():
+                base_name = os.path.basename(info.filename)
+                if info.is_dir() or not base_name or base_name.startswith(".") or info.filename.startswith("__MACOSX/"):
+                    continue
+                # Nested archives, images, spreadsheets and the like are never decompressed
+                if file_extension(base_name) not in SUPPORTED_FORMATS:
+                    skipped.append(base_name)
+                    continue
+                members.append((info, base_name))
+                # zipfile never decompresses past the declared file_size, so this bounds memory
+                total_bytes += info.file_size
+            check_limits(len(entries) + len(members) + len(skipped))
+            for info, base_name in members:
+                entries.append((archive.read(info), base_name))
+    return entries, skipped
+
+@router.post("/bulk", response_model=BulkUploadResponse)
+async def upload_documents_bulk(
+    files: List[UploadFile] = File(...),
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user)
+):
+    uploads = [(await file.read(), file.filename) for file in files]
+    # Decompression is CPU-bound, so keep it off the event loop too
+    entries, skipped = await run_in_threadpool(_expand_uploads, uploads)
+    if not entries:
+        raise HTTPException(status_code=400, detail="No supported files to upload")
+
+    # Extraction and embedding block, so keep them off the event loop. They also run before
+    # any database work: on SQLite an open write transaction locks out every other writer
+    results = await run_in_threadpool(
+        lambda: _ingest_file_service().embed_files(entries, batch_size=EMBED_BATCH_SIZE)
+    )
+    failed = [file_name for (_, file_name), result in zip(entries, results) if result is None]
+    ingested = [(file_name, result) for (_, file_name), result in zip(entries, results) if result is not None]
+    if not ingested:
+        raise HTTPException(status_code=422, detail=f"Could not read any of the files: {', '.join(failed)}")
+
+    # One flush assigns every document id, one add tags the vectors with them, one commit
+    new_docs = [
+        Document(
+            user_id=current_user.id,
+            filename=file_name,
+            text_content="(raw text or omitted for large docs...)"
+        ) for file_name, _ in ingested
+    ]
+    db.add_all(new_docs)
+    db.flush()
+
+    chunks, vectors, document_ids = [], [], []
+    for document, (_, (file_chunks, file_embeddings)) in zip(new_docs, ingested):
+        chunks.extend(file_chunks)
+        vectors.extend(file_embeddings)
+        document_ids.extend([document.id] * len(file_chunks))
+    if chunks:
+        await run_in_threadpool(
+            embeddings_manager.add_embeddings_for_user,
+            str(current_user.id), np.array(vectors), chunks, document_ids=document_ids
+        )
+
+    db.commit()
+    return {
+        "msg": f"{len(new_docs)} files uploaded",
+        "document_ids": [d.id for d in new_docs],
+        "skipped": skipped,
+        "failed": failed
+    }
+
+@router.delete("/{document_id}", response_model=DocumentDeleteResponse)
+def delete_document(
+    document_id: int,
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user)
+):
+    document = db.query(Document).filter(
+        Document.id == document_id,
+        Document.user_id == current_user.id
+    ).first()
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    # Vectors are tombstoned right away; compaction runs in the background
+    chunks_removed = embeddings_manager.delete_document_for_user(str(current_user.id), document.id)
+
+    db.delete(document)
+    db.commit()
+    return {"msg": "Document deleted", "document_id": document_id, "chunks_removed": chunks_removed}
@@ -1,7 +1,7 @@
 # app/schemas/chat_schemas.py
 
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List
 
 class ChatRequest(BaseModel):
     session_id: Optional[int] = None
@@ -12,6 +12,17 @@ class FileUploadResponse(BaseModel):
     msg: str
     document_id: int
 
+class BulkUploadResponse(BaseModel):
+    msg: str
+    document_ids: List[int]
+    skipped: List[str] = []  # unsupported formats, never read
+    failed: List[str] = []  # text could not be extracted
+
+class DocumentDeleteResponse(BaseModel):
+    msg: str
+    document_id: int
+    chunks_removed: int
+
 class AskQuestionRequest(BaseModel):
     question: str
     model_name: str = "gpt-3.5-turbo"
\ No newline at end of file
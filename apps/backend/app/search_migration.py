@@ -0,0 +1,21 @@
+# app/search_migration.py
+#
+# One-off build of the Postgres chat search index on an existing chat_messages table:
+#
+#   DATABASE_URL=postgresql://... python -m app.search_migration
+#
+# Adding the generated column rewrites the table, so run it in a quiet window; the
+# index itself is built CONCURRENTLY and doesn't block writes. New databases get the
+# index when the table is created and don't need this.
+
+import logging
+
+from .database import engine
+from .models.chat_message import migrate_search_index
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if engine.dialect.name != "postgresql":
+        raise SystemExit(f"Only needed on Postgres; {engine.dialect.name} builds its index at startup")
+    migrate_search_index(engine)
+    logging.info("Chat search index built")
@@ -0,0 +1,101 @@
+# app/services/chat_search.py
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from ..models.chat_message import ChatMessage, postgres_search_ready
+from ..models.chat_session import ChatSession
+
+# Match and rank inside the FTS table first (scoped to the user by the query),
+# then join only the requested page back to messages and sessions
+SQLITE_SEARCH = text("""
+    SELECT m.id, m.session_id, s.session_name, m.role, m.content, m.timestamp, hits.snippet
+    FROM (
+        SELECT rowid, snippet(chat_messages_fts, 0, '[', ']', '...', 16) AS snippet,
+               bm25(chat_messages_fts, 1.0, 0.0, 0.0) AS rank
+        FROM chat_messages_fts
+        WHERE chat_messages_fts MATCH :query
+        ORDER BY rank, rowid DESC
+        LIMIT :limit OFFSET :offset
+    ) AS hits
+    JOIN chat_messages m ON m.id = hits.rowid
+    JOIN chat_sessions s ON s.id = m.session_id
+    ORDER BY hits.rank, m.id DESC
+""")
+
+# The (session_id, search_vector) GIN index restricts the match to the user's sessions,
+# ranking reads the stored vector, and only the requested page gets a headline
+POSTGRES_SEARCH = text("""
+    SELECT m.id, m.session_id, s.session_name, m.role, m.content, m.timestamp,
+           ts_headline('english', m.content, hits.q, 'StartSel=[, StopSel=], MaxFragments=1') AS snippet
+    FROM (
+        SELECT m.id, q, ts_rank_cd(m.search_vector, q) AS rank
+        FROM chat_messages m, websearch_to_tsquery('english', :query) AS q
+        WHERE m.session_id = ANY(:session_ids) AND m.search_vector @@ q
+        ORDER BY rank DESC, m.id DESC
+        LIMIT :limit OFFSET :offset
+    ) AS hits
+    JOIN chat_messages m ON m.id = hits.id
+    JOIN chat_sessions s ON s.id = m.session_id
+    ORDER BY hits.rank DESC, m.id DESC
+""")
+
+# Checked once per process; restart workers after running app.search_migration
+_postgres_ready = None
+
+def fts5_query(user_id: int, query: str) -> str:
+    """
+    Turns free text into an FTS5 query matching all terms in `content` for one user,
+    quoting every term so user input can't hit FTS5 syntax. Empty if there are no terms.
+    """
+    terms = ['"' + term.replace('"', '""') + '"' for term in query.split()]
+    if not terms:
+        return ""
+    return f'user_id:"{int(user_id)}" AND content:({" ".join(terms)})'
+
+def search_messages(db: Session, user_id: int, query: str, limit: int = 20, offset: int = 0) -> list[dict]:
+    """
+    Ranked full-text search over every ChatMessage in the user's sessions.
+    Messages still queued in the write-behind log become searchable once flushed.
+    The match itself is scoped to the user: by the user_id token on SQLite, by
+    the user's session ids on Postgres.
+    """
+    global _postgres_ready
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql" and _postgres_ready is None:
+        _postgres_ready = postgres_search_ready(db.connection())
+
+    if dialect == "sqlite":
+        # The user filter is part of the MATCH expression
+        params = {"query": fts5_query(user_id, query), "limit": limit, "offset": offset}
+        if not params["query"]:
+            return []
+        rows = db.execute(SQLITE_SEARCH, params).mappings().all()
+    elif dialect == "postgresql" and _postgres_ready:
+        session_ids = [row.id for row in db.query(ChatSession.id).filter(ChatSession.user_id == user_id)]
+        if not session_ids:
+            return []
+        params = {"query": query, "session_ids": session_ids, "limit": limit, "offset": offset}
+        rows = db.execute(POSTGRES_SEARCH, params).mappings().all()
+    else:
+        # No full-text index for this backend (or not migrated yet): unranked substring scan
+        rows = db.query(
+            ChatMessage.id, ChatMessage.session_id, ChatSession.session_name,
+            ChatMessage.role, ChatMessage.content, ChatMessage.timestamp, ChatMessage.content.label("snippet")
+        ).join(ChatSession, ChatSession.id == ChatMessage.session_id).filter(
+            ChatSession.user_id == user_id,
+            ChatMessage.content.ilike(f"%{query}%")
+        ).order_by(ChatMessage.id.desc()).limit(limit).offset(offset).all()
+        rows = [row._mapping for row in rows]
+
+    return [
+        {
+            "message_id": row["id"],
+            "session_id": row["session_id"],
+            "session_name": row["session_name"],
+            "role": row["role"],
+            "content": row["content"],
+            "snippet": row["snippet"],
+            "timestamp": row["timestamp"]
+        } for row in rows
+    ]
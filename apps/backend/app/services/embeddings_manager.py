@@ -1,65 +1,597 @@
 # app/services/embeddings_manager.py
 
+import os
+import json
+import fcntl
+import shutil
+import threading
+from contextlib import contextmanager
+
 import numpy as np
-import faiss
+
+# faiss is imported inside the functions that need it, so importing this module
+# (e.g. from the upload router) stays cheap until an index is actually touched
+
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = ".lock"
+SEGMENTS_DIR = "segments"
+CODECS_DIR = "codecs"
+KEEP_VERSIONS = 2
+# A reader can lose the race with two publishes pruning the version it just picked
+RELOAD_ATTEMPTS = 3
+# Past this many segments the smaller half is merged in the background
+MAX_SEGMENTS = 8
+
+# "flat" keeps float32 codes; the others trade recall for memory
+QUANTIZATIONS = ("flat", "fp16", "int8", "pq")
+# int8 codes only learn per-dimension ranges, so a few hundred vectors train them
+MIN_TRAIN_VECTORS = 256
+# PQ learns 256 centroids per sub-quantizer, and k-means wants ~39 points per centroid
+PQ_MIN_TRAIN_VECTORS = 39 * 256
+# Trained codes are retrained once the live vectors have grown by this factor since training
+RETRAIN_GROWTH = 2.0
 
 def normalize_embeddings(embeddings: np.ndarray) -> np.ndarray:
     norm = np.linalg.norm(embeddings, axis=1, keepdims=True)
     return embeddings / norm
 
+def build_index(dimension: int, quantization: str = "flat", train_embeddings: np.ndarray = None, pq_m: int = 96):
+    """
+    Returns an IndexIDMap2 over an inner-product index with the requested codes,
+    trained on `train_embeddings` when the quantizer needs it.
+    """
+    import faiss
+
+    if quantization == "flat":
+        index = faiss.IndexFlatIP(dimension)
+    elif quantization == "fp16":
+        index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+    elif quantization == "int8":
+        index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+    elif quantization == "pq":
+        if dimension % pq_m:
+            raise ValueError(f"pq_m={pq_m} must divide the embedding dimension {dimension}")
+        index = faiss.IndexPQ(dimension, pq_m, 8, faiss.METRIC_INNER_PRODUCT)
+    else:
+        raise ValueError(f"Unknown quantization '{quantization}', expected one of {QUANTIZATIONS}")
+
+    if not index.is_trained:
+        index.train(train_embeddings)
+    return faiss.IndexIDMap2(index)
+
+class Segment:
+    """
+    An immutable slice of a user's chunks: an index encoded with the user's
+    codec, the full-precision vectors (rows aligned with the sorted
+    `chunk_ids`) and the chunk texts and owning documents.
+    """
+    def __init__(self, name: str, faiss_index, embeddings: np.ndarray, chunk_ids: np.ndarray,
+                 chunk_texts: dict, chunk_documents: dict):
+        self.name = name
+        self.faiss_index = faiss_index
+        self.embeddings = embeddings
+        self.chunk_ids = chunk_ids
+        self.chunk_texts = chunk_texts
+        self.chunk_documents = chunk_documents
+
+    def vectors(self, chunk_ids: np.ndarray) -> np.ndarray:
+        return np.asarray(self.embeddings[np.searchsorted(self.chunk_ids, chunk_ids)])
+
 class EmbeddingsManager:
     """
     Manages a FAISS index for user documents.
-    For demonstration, we keep a separate index per user_id in memory.
+    A user's chunks live in immutable segments, and a user's state is one
+    entry in memory that is only ever replaced, never modified, so a search
+    always works on a consistent snapshot. When `index_dir` is set, every
+    write is also published to disk so that all uvicorn workers share one
+    view of a user's documents:
+      - writers serialize on a per-user file lock, write only what changed
+        (a new segment for an upload, nothing but the manifest for a delete)
+        and then a `v<N>.json` manifest listing the live segments,
+      - `CURRENT` is then atomically swapped to point at that manifest,
+      - readers compare `CURRENT` with the version they hold and only load
+        the segments they don't have yet. On faiss >= 1.9 the flat/SQ/PQ
+        codes are mmap'd with IO_FLAG_MMAP_IFC, so workers share them through
+        the page cache; older faiss copies the codes into every worker.
+
+    Every chunk gets a stable int64 id and remembers the document it came
+    from. Deleting a document only tombstones its chunk ids; searches skip
+    them. A background thread rebuilds the index once the tombstoned
+    fraction crosses `compact_threshold`, and merges the smaller segments
+    once there are more than MAX_SEGMENTS.
+
+    `quantization` picks the index codes ("flat", "fp16", "int8" or "pq").
+    int8 needs MIN_TRAIN_VECTORS to train and PQ needs PQ_MIN_TRAIN_VECTORS,
+    so a user's index starts as fp16 and is rebuilt in the background with
+    the requested codes once it has enough vectors, and again whenever it has
+    grown RETRAIN_GROWTH times past the vectors the codes were trained on.
+    Full-precision vectors are kept once, mmap'd from disk when `index_dir`
+    is set; with `rerank_factor` > 0 searches fetch `k * rerank_factor`
+    candidates from the compressed index and re-rank them exactly.
     """
-    def __init__(self):
-        self.user_indices = {}  # user_id -> { "faiss_index": ..., "doc_texts": [...], "embeddings": np.ndarray }
+    def __init__(self, index_dir: str = None, compact_threshold: float = 0.2,
+                 quantization: str = "flat", rerank_factor: int = 0, pq_m: int = 96):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization '{quantization}', expected one of {QUANTIZATIONS}")
+        self.index_dir = index_dir
+        self.compact_threshold = compact_threshold
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor
+        self.pq_m = pq_m
+        # user_id -> {
+        #     "segments": tuple of Segment, "codec": empty IndexIDMap2 new segments are cloned from,
+        #     "codec_name": str, "quantization": str, "trained_on": int, "dimension": int,
+        #     "tombstones": frozenset, "next_id": int, "version": int
+        # }
+        self.user_indices = {}
+        self._lock = threading.Lock()  # guards _user_locks and _compacting
+        self._user_locks = {}  # user_id -> RLock, so one user's publish doesn't block the others
+        self._compacting = set()
 
-    def create_index_for_user(self, user_id: str, embeddings: np.ndarray, doc_texts: list[str]):
-        embeddings = embeddings.astype('float32')
-        embeddings = normalize_embeddings(embeddings)
-        dimension = embeddings.shape[1]
+    def create_index_for_user(self, user_id: str, embeddings: np.ndarray, doc_texts: list[str], document_id: int = None,
+                              document_ids: list[int] = None):
+        """Replaces whatever the user had with these chunks."""
+        with self._write_lock(user_id):
+            version = self._next_version(user_id)
+            user_data = self._empty_entry(embeddings, version)
+            chunk_ids = self._append(user_id, user_data, version, embeddings, doc_texts, document_id, document_ids)
+        return chunk_ids
 
-        faiss_index = faiss.IndexFlatIP(dimension)
-        faiss_index.add(embeddings)
+    def add_embeddings_for_user(self, user_id: str, embeddings: np.ndarray, doc_texts: list[str], document_id: int = None,
+                                document_ids: list[int] = None):
+        """
+        Adds chunks tagged with `document_id`, or with one id per chunk via `document_ids`
+        when several documents go in at once. Returns the new chunk ids.
+        """
+        with self._write_lock(user_id):
+            # Another worker may have written since we last looked
+            self._refresh_user(user_id)
 
-        self.user_indices[user_id] = {
-            "faiss_index": faiss_index,
-            "doc_texts": doc_texts,
-            "embeddings": embeddings
-        }
+            version = self._next_version(user_id)
+            user_data = self.user_indices.get(user_id) or self._empty_entry(embeddings, version)
+            chunk_ids = self._append(user_id, user_data, version, embeddings, doc_texts, document_id, document_ids)
 
-    def add_embeddings_for_user(self, user_id: str, embeddings: np.ndarray, doc_texts: list[str]):
-        if user_id not in self.user_indices:
-            self.create_index_for_user(user_id, embeddings, doc_texts)
-        else:
-            user_data = self.user_indices[user_id]
-            old_index = user_data["faiss_index"]
-            old_texts = user_data["doc_texts"]
-            old_embeddings = user_data["embeddings"]
+        if self._needs_compaction(self.user_indices[user_id]):
+            self._schedule_compaction(user_id)
+        return chunk_ids
+
+    def delete_document_for_user(self, user_id: str, document_id: int) -> int:
+        """Tombstones every chunk of `document_id`. Returns how many chunks were removed."""
+        with self._write_lock(user_id):
+            self._refresh_user(user_id)
+            user_data = self.user_indices.get(user_id)
+            if user_data is None:
+                return 0
 
-            embeddings = embeddings.astype('float32')
-            embeddings = normalize_embeddings(embeddings)
+            deleted = {
+                cid for segment in user_data["segments"]
+                for cid, did in segment.chunk_documents.items()
+                if did == document_id and cid not in user_data["tombstones"]
+            }
+            if not deleted:
+                return 0
+            # Only the manifest changes; the segments stay as they are
+            self._publish(user_id, {
+                **user_data,
+                "tombstones": user_data["tombstones"] | deleted,
+                "version": self._next_version(user_id)
+            })
 
-            new_embeddings = np.concatenate([old_embeddings, embeddings], axis=0)
-            old_index.add(embeddings)
+        if self._needs_compaction(self.user_indices[user_id]):
+            self._schedule_compaction(user_id)
+        return len(deleted)
 
-            user_data["doc_texts"] = old_texts + doc_texts
-            user_data["embeddings"] = new_embeddings
+    def deleted_fraction(self, user_id: str) -> float:
+        user_data = self.user_indices.get(user_id)
+        if user_data is None:
+            return 0.0
+        ntotal = self._ntotal(user_data)
+        return len(user_data["tombstones"]) / ntotal if ntotal else 0.0
 
     def search_user_index(self, user_id: str, query_embedding: np.ndarray, k=5) -> str:
-        if user_id not in self.user_indices:
+        self._refresh_user(user_id)
+        # Grab one consistent snapshot; writers swap the whole entry
+        user_data = self.user_indices.get(user_id)
+        if user_data is None:
             return ""
+        hits = self._search(user_data, query_embedding, k)
+        return "\n\n".join(segment.chunk_texts[cid] for cid, _, segment in hits)
 
+    def search_user_ids(self, user_id: str, query_embedding: np.ndarray, k=5) -> list[tuple[int, float]]:
+        """Like search_user_index, but returns (chunk_id, score) pairs."""
+        self._refresh_user(user_id)
+        user_data = self.user_indices.get(user_id)
+        if user_data is None:
+            return []
+        return [(cid, score) for cid, score, _ in self._search(user_data, query_embedding, k)]
+
+    def _search(self, user_data: dict, query_embedding: np.ndarray, k: int) -> list[tuple[int, float, Segment]]:
         query_embedding = np.array(query_embedding).astype('float32')
         query_embedding = normalize_embeddings(query_embedding.reshape(1, -1))
+        tombstones = user_data["tombstones"]
+
+        # Over-fetch so that tombstoned hits don't eat into the k results
+        fetch_k = k + len(tombstones)
+        if self.rerank_factor:
+            fetch_k *= self.rerank_factor
+
+        hits = []
+        for segment in user_data["segments"]:
+            segment_k = min(fetch_k, segment.faiss_index.ntotal)
+            if segment_k == 0:
+                continue
+            scores, ids = segment.faiss_index.search(query_embedding, segment_k)
+            for cid, score in zip(ids[0], scores[0]):
+                cid = int(cid)
+                if cid < 0 or cid in tombstones:
+                    continue
+                hits.append((cid, float(score), segment))
+        hits.sort(key=lambda hit: -hit[1])
+        hits = hits[:fetch_k]
+
+        if self.rerank_factor and hits:
+            # Exact scores for the candidates from the full-precision vectors
+            exact = [
+                float(segment.vectors(np.array([cid], dtype='int64'))[0] @ query_embedding[0])
+                for cid, _, segment in hits
+            ]
+            hits = [(cid, score, segment) for score, (cid, _, segment) in zip(exact, hits)]
+            hits.sort(key=lambda hit: -hit[1])
+        return hits[:k]
+
+    def compact_user_index(self, user_id: str):
+        """
+        Rebuilds a user's index without tombstoned chunks (retraining the codes if needed),
+        or else merges the smaller segments. Searches keep using the old entry until the swap.
+        """
+        try:
+            with self._write_lock(user_id):
+                self._refresh_user(user_id)
+                user_data = self.user_indices.get(user_id)
+                if user_data is None:
+                    return
+
+                version = self._next_version(user_id)
+                if user_data["tombstones"] or self._needs_retrain(user_data):
+                    self._publish(user_id, self._rebuild(user_id, user_data, version))
+                elif len(user_data["segments"]) > MAX_SEGMENTS:
+                    self._publish(user_id, self._merge_smallest(user_id, user_data, version))
+        finally:
+            with self._lock:
+                self._compacting.discard(user_id)
+
+    def _schedule_compaction(self, user_id: str):
+        with self._lock:
+            if user_id in self._compacting:
+                return
+            self._compacting.add(user_id)
+        threading.Thread(target=self.compact_user_index, args=(user_id,), daemon=True).start()
+
+    def _needs_compaction(self, user_data: dict) -> bool:
+        ntotal = self._ntotal(user_data)
+        return ((ntotal and len(user_data["tombstones"]) / ntotal >= self.compact_threshold)
+                or self._needs_retrain(user_data)
+                or len(user_data["segments"]) > MAX_SEGMENTS)
+
+    def _pick_quantization(self, n_vectors: int) -> str:
+        if self.quantization == "int8" and n_vectors < MIN_TRAIN_VECTORS:
+            return "fp16"
+        if self.quantization == "pq" and n_vectors < PQ_MIN_TRAIN_VECTORS:
+            return "fp16"
+        return self.quantization
+
+    @staticmethod
+    def _trained_on(quantization: str, n_vectors: int) -> int:
+        """How many vectors a freshly built codec was trained on; 0 for codes that need no training."""
+        return n_vectors if quantization in ("int8", "pq") else 0
+
+    def _needs_retrain(self, user_data: dict) -> bool:
+        live = self._ntotal(user_data) - len(user_data["tombstones"])
+        if user_data["quantization"] != self._pick_quantization(live):
+            return True
+        # Codes trained on a small early corpus drift as it grows
+        return 0 < user_data["trained_on"] and live >= user_data["trained_on"] * RETRAIN_GROWTH
+
+    @staticmethod
+    def _ntotal(user_data: dict) -> int:
+        return sum(segment.faiss_index.ntotal for segment in user_data["segments"])
+
+    def _live_rows(self, user_data: dict, segments) -> tuple[np.ndarray, np.ndarray, list, list]:
+        """Live vectors, chunk ids, texts and documents of `segments`, sorted by chunk id."""
+        tombstones = list(user_data["tombstones"])
+        parts = []
+        for segment in segments:
+            keep = ~np.isin(segment.chunk_ids, tombstones)
+            ids = segment.chunk_ids[keep]
+            parts.append((np.asarray(segment.embeddings[keep]), ids, segment))
+        dimension = user_data["dimension"]
+        embeddings = np.concatenate([p[0] for p in parts]) if parts else np.empty((0, dimension), dtype='float32')
+        chunk_ids = np.concatenate([p[1] for p in parts]) if parts else np.empty((0,), dtype='int64')
+        order = np.argsort(chunk_ids, kind="stable")
+        embeddings, chunk_ids = np.ascontiguousarray(embeddings[order]), np.ascontiguousarray(chunk_ids[order])
+
+        owner = {}
+        for _, ids, segment in parts:
+            for cid in ids.tolist():
+                owner[cid] = segment
+        texts = [owner[cid].chunk_texts[cid] for cid in chunk_ids.tolist()]
+        documents = [owner[cid].chunk_documents[cid] for cid in chunk_ids.tolist()]
+        return embeddings, chunk_ids, texts, documents
+
+    def _rebuild(self, user_id: str, user_data: dict, version: int) -> dict:
+        """Returns a new entry with one segment over the live vectors, encoded with freshly trained codes."""
+        embeddings, chunk_ids, texts, documents = self._live_rows(user_data, user_data["segments"])
+
+        quantization = self._pick_quantization(len(chunk_ids))
+        codec = build_index(user_data["dimension"], quantization, embeddings, self.pq_m)
+        segment = self._write_segment(user_id, f"s{version}", codec, embeddings, chunk_ids, texts, documents)
+        return {
+            **user_data,
+            "segments": (segment,),
+            "codec": codec,
+            "codec_name": f"c{version}",
+            "quantization": quantization,
+            "trained_on": self._trained_on(quantization, len(chunk_ids)),
+            "tombstones": frozenset(),
+            "version": version
+        }
+
+    def _merge_smallest(self, user_id: str, user_data: dict, version: int) -> dict:
+        """Returns a new entry where the smaller half of the segments is merged into one, with the same codes."""
+        by_size = sorted(user_data["segments"], key=lambda segment: segment.faiss_index.ntotal)
+        merged, kept = by_size[:(len(by_size) + 1) // 2], by_size[(len(by_size) + 1) // 2:]
+
+        embeddings, chunk_ids, texts, documents = self._live_rows(user_data, merged)
+        segment = self._write_segment(user_id, f"s{version}", user_data["codec"], embeddings, chunk_ids, texts, documents)
+        dropped = {cid for s in merged for cid in s.chunk_ids.tolist()} & user_data["tombstones"]
+        return {
+            **user_data,
+            "segments": tuple(kept) + (segment,),
+            "tombstones": user_data["tombstones"] - dropped,
+            "version": version
+        }
+
+    def _empty_entry(self, embeddings: np.ndarray, version: int) -> dict:
+        """An entry with no segments whose codec is trained on `embeddings` when the codes need it."""
+        embeddings = normalize_embeddings(embeddings.astype('float32'))
+        dimension = embeddings.shape[1]
+        quantization = self._pick_quantization(len(embeddings))
+        return {
+            "segments": (),
+            "codec": build_index(dimension, quantization, embeddings, self.pq_m),
+            "codec_name": f"c{version}",
+            "quantization": quantization,
+            "trained_on": self._trained_on(quantization, len(embeddings)),
+            "dimension": dimension,
+            "tombstones": frozenset(),
+            "next_id": 0,
+            "version": version
+        }
+
+    def _append(self, user_id: str, user_data: dict, version: int, embeddings: np.ndarray, doc_texts: list[str],
+                document_id: int = None, document_ids: list[int] = None) -> list[int]:
+        """Writes the chunks as a new segment and publishes an entry that includes it. Caller holds the write lock."""
+        embeddings = embeddings.astype('float32')
+        embeddings = normalize_embeddings(embeddings)
+
+        start = user_data["next_id"]
+        chunk_ids = np.arange(start, start + len(doc_texts), dtype='int64')
+        if document_ids is None:
+            document_ids = [document_id] * len(doc_texts)
+
+        segment = self._write_segment(user_id, f"s{version}", user_data["codec"], embeddings, chunk_ids,
+                                      list(doc_texts), list(document_ids))
+        self._publish(user_id, {
+            **user_data,
+            "segments": user_data["segments"] + (segment,),
+            "next_id": start + len(doc_texts),
+            "version": version
+        })
+        return chunk_ids.tolist()
+
+    def _write_segment(self, user_id: str, name: str, codec, embeddings: np.ndarray, chunk_ids: np.ndarray,
+                       texts: list[str], documents: list) -> Segment:
+        """Encodes the rows with a copy of `codec`; with `index_dir` set, the segment is written and mmap'd back."""
+        import faiss
+
+        faiss_index = faiss.clone_index(codec)
+        if len(chunk_ids):
+            faiss_index.add_with_ids(embeddings, chunk_ids)
+        if not self.index_dir:
+            return Segment(name, faiss_index, embeddings, chunk_ids,
+                           dict(zip(chunk_ids.tolist(), texts)), dict(zip(chunk_ids.tolist(), documents)))
+
+        segment_dir = os.path.join(self._user_dir(user_id), SEGMENTS_DIR, name)
+        tmp_dir = segment_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        faiss.write_index(faiss_index, os.path.join(tmp_dir, "index.faiss"))
+        np.save(os.path.join(tmp_dir, "embeddings.npy"), embeddings)
+        np.save(os.path.join(tmp_dir, "chunk_ids.npy"), chunk_ids)
+        with open(os.path.join(tmp_dir, "chunks.json"), "w") as f:
+            json.dump({"texts": texts, "documents": documents}, f)
+        os.replace(tmp_dir, segment_dir)
+        # Drop the in-memory copy in favour of the published files
+        return self._load_segment(user_id, name)
+
+    # --- shared on-disk state -------------------------------------------------
+
+    def _user_dir(self, user_id: str) -> str:
+        return os.path.join(self.index_dir, str(user_id))
+
+    @contextmanager
+    def _write_lock(self, user_id: str):
+        """Single writer per user, across threads and across processes."""
+        with self._lock:
+            user_lock = self._user_locks.setdefault(user_id, threading.RLock())
+        with user_lock:
+            if not self.index_dir:
+                yield
+                return
+            user_dir = self._user_dir(user_id)
+            # Created on first write, not when the manager is constructed
+            os.makedirs(user_dir, exist_ok=True)
+            with open(os.path.join(user_dir, LOCK_FILE), "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _current_version(self, user_id: str) -> int:
+        if not self.index_dir:
+            return 0
+        try:
+            with open(os.path.join(self._user_dir(user_id), CURRENT_FILE)) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _next_version(self, user_id: str) -> int:
+        """Caller holds the write lock."""
+        if self.index_dir:
+            return self._current_version(user_id) + 1
+        user_data = self.user_indices.get(user_id)
+        return (user_data["version"] if user_data else 0) + 1
+
+    def _refresh_user(self, user_id: str):
+        """Pick up a newer version published by another worker, loading only the segments we don't have."""
+        if not self.index_dir:
+            return
+        version = self._current_version(user_id)
+        if version == 0:
+            return
+        user_data = self.user_indices.get(user_id)
+        if user_data is not None and user_data["version"] == version:
+            return
+
+        for attempt in range(RELOAD_ATTEMPTS):
+            try:
+                loaded = self._load_version(user_id, version, user_data)
+                break
+            except (FileNotFoundError, RuntimeError):
+                # faiss raises RuntimeError for a missing file; the version was pruned under us
+                if attempt == RELOAD_ATTEMPTS - 1:
+                    raise
+                version = self._current_version(user_id)
+        # Swap the whole entry at once so concurrent searches never see a mix of versions
+        self.user_indices[user_id] = loaded
+
+    def _load_version(self, user_id: str, version: int, previous: dict = None) -> dict:
+        import faiss
+
+        user_dir = self._user_dir(user_id)
+        with open(os.path.join(user_dir, f"v{version}.json")) as f:
+            manifest = json.load(f)
+
+        # Segments are immutable, so the ones we already hold are reused as they are
+        known = {segment.name: segment for segment in previous["segments"]} if previous else {}
+        segments = tuple(known.get(name) or self._load_segment(user_id, name) for name in manifest["segments"])
+        if previous and previous["codec_name"] == manifest["codec"]:
+            codec = previous["codec"]
+        else:
+            codec = faiss.read_index(os.path.join(user_dir, CODECS_DIR, f"{manifest['codec']}.faiss"))
+        return {
+            "segments": segments,
+            "codec": codec,
+            "codec_name": manifest["codec"],
+            "quantization": manifest["quantization"],
+            "trained_on": manifest["trained_on"],
+            "dimension": manifest["dimension"],
+            "tombstones": frozenset(manifest["tombstones"]),
+            "next_id": manifest["next_id"],
+            "version": version
+        }
+
+    def _load_segment(self, user_id: str, name: str) -> Segment:
+        import faiss
+
+        segment_dir = os.path.join(self._user_dir(user_id), SEGMENTS_DIR, name)
+        # IO_FLAG_MMAP only covers IVF inverted lists; flat codes need IO_FLAG_MMAP_IFC (faiss >= 1.9)
+        faiss_index = faiss.read_index(
+            os.path.join(segment_dir, "index.faiss"),
+            getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY
+        )
+        # Full-precision vectors are only needed for re-ranking and rebuilds, so they stay on disk
+        embeddings = np.load(os.path.join(segment_dir, "embeddings.npy"), mmap_mode="r")
+        chunk_ids = np.load(os.path.join(segment_dir, "chunk_ids.npy"))
+        with open(os.path.join(segment_dir, "chunks.json")) as f:
+            chunks = json.load(f)
+        ids = chunk_ids.tolist()
+        return Segment(name, faiss_index, embeddings, chunk_ids,
+                       dict(zip(ids, chunks["texts"])), dict(zip(ids, chunks["documents"])))
+
+    def _publish(self, user_id: str, user_data: dict):
+        """
+        Makes `user_data` the user's entry. With `index_dir` set, its manifest (and codec, if new)
+        is written and CURRENT pointed at it; segments were already written. Caller holds the write lock.
+        """
+        if not self.index_dir:
+            self.user_indices[user_id] = user_data
+            return
+        import faiss
+
+        user_dir = self._user_dir(user_id)
+        version = user_data["version"]
+
+        codec_path = os.path.join(user_dir, CODECS_DIR, f"{user_data['codec_name']}.faiss")
+        if not os.path.exists(codec_path):
+            os.makedirs(os.path.dirname(codec_path), exist_ok=True)
+            faiss.write_index(user_data["codec"], codec_path + ".tmp")
+            os.replace(codec_path + ".tmp", codec_path)
+
+        manifest_path = os.path.join(user_dir, f"v{version}.json")
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump({
+                "segments": [segment.name for segment in user_data["segments"]],
+                "codec": user_data["codec_name"],
+                "quantization": user_data["quantization"],
+                "trained_on": user_data["trained_on"],
+                "dimension": user_data["dimension"],
+                "tombstones": sorted(user_data["tombstones"]),
+                "next_id": user_data["next_id"]
+            }, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+        tmp_current = os.path.join(user_dir, CURRENT_FILE + ".tmp")
+        with open(tmp_current, "w") as f:
+            f.write(str(version))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_current, os.path.join(user_dir, CURRENT_FILE))
+        self.user_indices[user_id] = user_data
+
+        self._prune(user_id, version)
 
-        faiss_index = self.user_indices[user_id]["faiss_index"]
-        doc_texts = self.user_indices[user_id]["doc_texts"]
+    def _prune(self, user_id: str, version: int):
+        """
+        Drops manifests older than the last KEEP_VERSIONS, then every segment and codec none of the
+        kept manifests use. Readers that already opened them keep their inodes alive; one that loses
+        the race before opening retries with the new CURRENT (see _refresh_user).
+        """
+        user_dir = self._user_dir(user_id)
+        referenced = set()
+        for name in os.listdir(user_dir):
+            if not (name.startswith("v") and name.endswith(".json")):
+                continue
+            manifest_version = int(name[1:-len(".json")])
+            if manifest_version <= version - KEEP_VERSIONS:
+                os.remove(os.path.join(user_dir, name))
+                continue
+            try:
+                with open(os.path.join(user_dir, name)) as f:
+                    manifest = json.load(f)
+            except FileNotFoundError:
+                continue
+            referenced.update(manifest["segments"])
+            referenced.add(manifest["codec"])
 
-        distances, indices = faiss_index.search(query_embedding, k)
-        content = []
-        for i in range(len(indices[0])):
-            idx = indices[0][i]
-            content.append(doc_texts[idx])
-        return "\n\n".join(content)
\ No newline at end of file
+        for subdir, suffix in ((SEGMENTS_DIR, ""), (CODECS_DIR, ".faiss")):
+            for name in os.listdir(os.path.join(user_dir, subdir)):
+                if name.endswith(".tmp") or name[:len(name) - len(suffix)] in referenced:
+                    continue
+                path = os.path.join(user_dir, subdir, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
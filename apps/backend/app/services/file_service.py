@@ -1,39 +1,134 @@
 # app/services/file_service.py
 
+import os
+import logging
+import threading
+import multiprocessing
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from .text_extractor import PDFTextExtractor, DOCXTextExtractor, TXTTextExtractor
 from .text_processor import TextProcessor
 from .embeddings_manager import EmbeddingsManager
 
+logger = logging.getLogger("uvicorn.error")
+
 pdf_extractor = PDFTextExtractor()
 docx_extractor = DOCXTextExtractor()
 txt_extractor = TXTTextExtractor()
 
+# Formats worth shipping to another process; plain text is decoded inline
+POOLED_FORMATS = ("pdf", "docx")
+# Decoded as UTF-8 text
+TEXT_FORMATS = ("txt", "md", "csv")
+SUPPORTED_FORMATS = POOLED_FORMATS + TEXT_FORMATS
+
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+
+def get_extract_pool() -> ProcessPoolExecutor:
+    """The process-wide extraction pool, sized by EXTRACT_WORKERS on first use."""
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None:
+            from ..config import EXTRACT_WORKERS
+
+            # forkserver: forking this process would copy the scheduler, message-log
+            # and OpenMP threads' locks into the children and can deadlock them
+            _extract_pool = ProcessPoolExecutor(
+                max_workers=EXTRACT_WORKERS or os.cpu_count(),
+                mp_context=multiprocessing.get_context("forkserver")
+            )
+        return _extract_pool
+
+def shutdown_extract_pool():
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is not None:
+            _extract_pool.shutdown(wait=True)
+            _extract_pool = None
+
+def file_extension(file_name: str) -> str:
+    return file_name.split(".")[-1].lower()
+
+def extract_text(file_bytes: bytes, file_name: str) -> str:
+    ext = file_extension(file_name)
+
+    if ext == "pdf":
+        return pdf_extractor.extract_text(file_bytes)
+    elif ext == "docx":
+        return docx_extractor.extract_text(file_bytes)
+    else:
+        return txt_extractor.extract_text(file_bytes)
+
 class FileService:
-    def __init__(self, openai_client, config, embeddings_manager: EmbeddingsManager):
+    def __init__(self, openai_client, config, embeddings_manager: EmbeddingsManager, embeddings=None):
         self.openai_client = openai_client
         self.embeddings_manager = embeddings_manager
-        self.text_processor = TextProcessor(config)
+        self.text_processor = TextProcessor(config, embeddings=embeddings)
 
-    def process_file_for_user(self, user_id: str, file_bytes: bytes, file_name: str):
-        ext = file_name.split(".")[-1].lower()
-
-        if ext == "pdf":
-            text = pdf_extractor.extract_text(file_bytes)
-        elif ext == "docx":
-            text = docx_extractor.extract_text(file_bytes)
-        else:
-            text = txt_extractor.extract_text(file_bytes)
+    def embed_file(self, file_bytes: bytes, file_name: str) -> tuple[list[str], np.ndarray]:
+        """Extracts, chunks and embeds a file without touching any index. Returns (chunks, embeddings)."""
+        text = extract_text(file_bytes, file_name)
 
         # Create chunks
         chunks = self.text_processor.create_chunks(text)
 
-        # Embed each chunk
+        # One call for all chunks, so the scheduler can send them in full batches
+        chunk_embeddings = self.openai_client.create_embeddings(chunks) if chunks else []
+        return chunks, np.array(chunk_embeddings)
+
+    def process_file_for_user(self, user_id: str, file_bytes: bytes, file_name: str, document_id: int = None):
+        chunks, chunk_embeddings = self.embed_file(file_bytes, file_name)
+        if not chunks:
+            return []
+
+        # Add to the user’s FAISS index, tagged with the owning document
+        return self.embeddings_manager.add_embeddings_for_user(user_id, chunk_embeddings, chunks, document_id=document_id)
+
+    def embed_files(self, files: list[tuple[bytes, str]], batch_size: int = 16) -> list:
+        """
+        Bulk version of embed_file for a list of (bytes, file_name). PDFs and DOCX
+        files are extracted in a process pool, and chunks from all files share
+        embedding requests of up to `batch_size` inputs. Returns one (chunks,
+        embeddings) pair per file, or None for a file whose text could not be
+        extracted; that is logged and the other files carry on.
+        """
+        pool = get_extract_pool()
+        pending = {}
+        texts = [None] * len(files)
+        for i, (file_bytes, file_name) in enumerate(files):
+            try:
+                if file_extension(file_name) in POOLED_FORMATS:
+                    pending[i] = pool.submit(extract_text, file_bytes, file_name)
+                else:
+                    texts[i] = extract_text(file_bytes, file_name)
+            except Exception:
+                logger.exception("Could not extract text from %s", file_name)
+        for i, future in pending.items():
+            try:
+                texts[i] = future.result()
+            except Exception:
+                logger.exception("Could not extract text from %s", files[i][1])
+
+        # Chunk every file, then embed in full batches that span file boundaries
+        file_chunks = []
+        for text in texts:
+            if text is None:
+                file_chunks.append(None)
+            else:
+                file_chunks.append(self.text_processor.create_chunks(text) if text.strip() else [])
+        all_chunks = [c for chunks in file_chunks if chunks for c in chunks]
         chunk_embeddings = []
-        for c in chunks:
-            emb = self.openai_client.create_embedding(c)
-            chunk_embeddings.append(emb)
+        for start in range(0, len(all_chunks), batch_size):
+            chunk_embeddings.extend(self.openai_client.create_embeddings(all_chunks[start:start + batch_size]))
         chunk_embeddings = np.array(chunk_embeddings)
 
-        # Add to the user’s FAISS index
-        self.embeddings_manager.add_embeddings_for_user(user_id, chunk_embeddings, chunks)
\ No newline at end of file
+        results = []
+        start = 0
+        for chunks in file_chunks:
+            if chunks is None:
+                results.append(None)
+                continue
+            results.append((chunks, chunk_embeddings[start:start + len(chunks)]))
+            start += len(chunks)
+        return results
@@ -0,0 +1,241 @@
+# app/services/message_log.py
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError, DataError
+
+from ..models.chat_message import ChatMessage
+
+logger = logging.getLogger("uvicorn.error")
+
+# The database rejected the rows themselves (e.g. their session was deleted); retrying can't help.
+# Anything else (lost connection, failover, "database is locked") is retried until it succeeds.
+REJECTED_ERRORS = (IntegrityError, DataError)
+RETRY_BASE_DELAY = 0.1
+MAX_RETRY_DELAY = 5.0
+# Most recent dead letters kept in memory for metrics; all of them go to the dead-letter file
+RECENT_DEAD_LETTERS = 100
+# Per-session timestamp state is dropped once a session has been idle this long
+TIMESTAMP_TTL = timedelta(seconds=1)
+
+class PendingMessage:
+    def __init__(self, session_id: int, role: str, content: str, timestamp: datetime):
+        self.session_id = session_id
+        self.role = role
+        self.content = content
+        self.timestamp = timestamp
+
+class MessageLog:
+    """
+    Write-behind log for ChatMessage rows.
+
+    `append` only queues a message; a background thread writes queued
+    messages in one transaction once `max_batch` are waiting or the oldest
+    has waited `flush_interval` seconds. Messages are written in append
+    order, and timestamps are made strictly increasing per session, so
+    ordering by timestamp matches the order of the conversation.
+    A message stays visible through `pending_for_session` until its batch
+    has committed, but only in this process; callers that need other
+    processes to see a message wait for it with `wait_until_written`.
+
+    Transient failures keep the batch queued and retry it with exponential
+    backoff. When the database rejects a batch (REJECTED_ERRORS) it is
+    written row by row, and only the rows that are rejected on their own
+    become dead letters: logged, appended as JSON lines to
+    `dead_letter_path`, and counted in `metrics`. Messages still queued
+    when `close` times out are saved there too.
+    """
+    def __init__(self, session_factory, flush_interval: float = 0.05, max_batch: int = 100,
+                 dead_letter_path: str = None):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.dead_letter_path = dead_letter_path
+        self._pending = []  # in append order; removed only after commit
+        self._last_timestamp = {}  # session_id -> last timestamp handed out
+        self.dead_letters = deque(maxlen=RECENT_DEAD_LETTERS)
+        self.dead_letter_count = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="message-log", daemon=True)
+        self._thread.start()
+
+    def append(self, session_id: int, role: str, content: str) -> PendingMessage:
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("MessageLog is closed")
+            timestamp = datetime.utcnow()
+            last = self._last_timestamp.get(session_id)
+            if last is not None and timestamp <= last:
+                timestamp = last + timedelta(microseconds=1)
+            self._last_timestamp[session_id] = timestamp
+
+            message = PendingMessage(session_id, role, content, timestamp)
+            self._pending.append(message)
+            self._cond.notify_all()
+            return message
+
+    def pending_for_session(self, session_id: int) -> list[PendingMessage]:
+        with self._cond:
+            return [m for m in self._pending if m.session_id == session_id]
+
+    def metrics(self) -> dict:
+        with self._cond:
+            return {
+                "pending": len(self._pending),
+                "dead_letters": self.dead_letter_count,
+                "dead_letter_path": self.dead_letter_path,
+            }
+
+    def flush(self, timeout: float = None) -> bool:
+        """Blocks until everything appended so far is committed. Returns False on timeout."""
+        with self._cond:
+            target = self._pending[-1] if self._pending else None
+        return self.wait_until_written(target, timeout)
+
+    def wait_until_written(self, message: PendingMessage, timeout: float = None) -> bool:
+        """
+        Blocks until `message` and everything appended before it have left the queue
+        (committed, or dead-lettered). Returns False on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while message is not None and message in self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(timeout=remaining)
+        return True
+
+    def close(self, timeout: float = 10.0) -> bool:
+        """Writes whatever is still queued and stops the flush thread. Returns False on timeout."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            with self._cond:
+                unwritten = list(self._pending)
+            logger.error("Message log did not drain within %ss, saving %d unwritten messages to %s",
+                         timeout, len(unwritten), self.dead_letter_path)
+            for message in unwritten:
+                self._dead_letter(message, "not written before shutdown")
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                # Give the batch time to fill up, unless it is already full or we're shutting down
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._pending) < self.max_batch and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(timeout=remaining)
+                batch = self._pending[:self.max_batch]
+
+            self._write_with_retries(batch)
+
+            with self._cond:
+                del self._pending[:len(batch)]
+                self._forget_idle_sessions()
+                self._cond.notify_all()
+
+    def _write_with_retries(self, batch: list[PendingMessage]):
+        if self._write_until_done(batch) is None:
+            return
+
+        # Isolate the rejected rows so the rest of the batch still lands, in order
+        for message in batch:
+            error = self._write_until_done([message])
+            if error is not None:
+                self._dead_letter(message, repr(error))
+
+    def _write_until_done(self, messages: list[PendingMessage]):
+        """Writes `messages`, retrying transient errors. Returns None, or the error the database rejected them with."""
+        attempt = 0
+        while True:
+            try:
+                self._write(messages)
+                return None
+            except REJECTED_ERRORS as e:
+                logger.exception("Database rejected %d chat messages", len(messages))
+                return e
+            except Exception:
+                attempt += 1
+                delay = min(RETRY_BASE_DELAY * 2 ** (attempt - 1), MAX_RETRY_DELAY)
+                logger.exception("Failed to write %d chat messages (attempt %d), retrying in %.1fs",
+                                 len(messages), attempt, delay)
+                time.sleep(delay)
+
+    def _dead_letter(self, message: PendingMessage, reason: str):
+        logger.error("Chat message for session %s moved to dead letters: %s", message.session_id, reason)
+        with self._cond:
+            self.dead_letters.append(message)
+            self.dead_letter_count += 1
+        if not self.dead_letter_path:
+            return
+        try:
+            with open(self.dead_letter_path, "a") as f:
+                f.write(json.dumps({
+                    "session_id": message.session_id,
+                    "role": message.role,
+                    "content": message.content,
+                    "timestamp": message.timestamp.isoformat(),
+                    "reason": reason
+                }) + "\n")
+        except OSError:
+            logger.exception("Could not save dead letter to %s", self.dead_letter_path)
+
+    def _forget_idle_sessions(self):
+        """Caller holds the lock. Keeps _last_timestamp bounded by the number of active sessions."""
+        active = {m.session_id for m in self._pending}
+        cutoff = datetime.utcnow() - TIMESTAMP_TTL
+        for session_id in [sid for sid, ts in self._last_timestamp.items() if sid not in active and ts < cutoff]:
+            del self._last_timestamp[session_id]
+
+    def _write(self, batch: list[PendingMessage]):
+        db = self.session_factory()
+        try:
+            db.add_all([
+                ChatMessage(session_id=m.session_id, role=m.role, content=m.content, timestamp=m.timestamp)
+                for m in batch
+            ])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+_message_log = None
+_message_log_lock = threading.Lock()
+
+def get_message_log() -> MessageLog:
+    """The process-wide message log, created on first use."""
+    global _message_log
+    with _message_log_lock:
+        if _message_log is None:
+            from ..config import MESSAGE_FLUSH_INTERVAL, MESSAGE_FLUSH_BATCH, MESSAGE_DEAD_LETTER_PATH
+            from ..database import SessionLocal
+
+            _message_log = MessageLog(SessionLocal, flush_interval=MESSAGE_FLUSH_INTERVAL, max_batch=MESSAGE_FLUSH_BATCH,
+                                      dead_letter_path=MESSAGE_DEAD_LETTER_PATH)
+        return _message_log
+
+def close_message_log():
+    global _message_log
+    with _message_log_lock:
+        if _message_log is not None:
+            _message_log.close()
+            _message_log = None
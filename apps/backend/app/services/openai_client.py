@@ -1,11 +1,11 @@
 # app/services/openai_client.py
 
-from openai import AzureOpenAI
-
 class OpenAIClient:
     """Handles direct calls to Azure/OpenAI endpoints."""
 
     def __init__(self, config):
+        from openai import AzureOpenAI
+
         self.client = AzureOpenAI(
             azure_endpoint=config.MODEL_ENDPOINT,
             api_key=config.MODEL_API_KEY,
@@ -21,6 +21,14 @@ class OpenAIClient:
         )
         return response.data[0].embedding
 
+    def create_embeddings(self, texts: list[str]):
+        """Embeds a batch of texts in one request; results keep the input order."""
+        response = self.client.embeddings.create(
+            input=texts,
+            model=self.embedding_model
+        )
+        return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
+
     def generate_chat_completion(self, system_prompt: str, user_message: str):
         """Non-streaming version (for reference)."""
         completion = self.client.chat.completions.create(
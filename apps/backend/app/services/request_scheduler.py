@@ -0,0 +1,396 @@
+# app/services/request_scheduler.py
+
+import fcntl
+import itertools
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Priority classes; lower runs first
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), good enough for quota accounting."""
+    return len(text) // 4 + 1
+
+class TokenBucket:
+    """
+    Tokens-per-minute budget that refills continuously.
+
+    With `state_path` the bucket lives in a flock'd file instead of this
+    process, so every worker and process role pointing at the same file
+    (e.g. on the shared INDEX_DIR volume) draws from one deployment quota.
+    """
+    def __init__(self, tokens_per_minute: int, state_path: str = None):
+        self.capacity = float(tokens_per_minute)
+        self.rate = self.capacity / 60.0
+        self.state_path = state_path
+        # Processes only agree on wall-clock time
+        self._clock = time.time if state_path else time.monotonic
+        self.tokens = self.capacity
+        self.updated = self._clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated) * self.rate)
+        self.updated = now
+
+    @contextmanager
+    def _state(self):
+        """Loads, refills and (for a shared bucket) saves the bucket around a read-modify-write."""
+        with self._lock:
+            if not self.state_path:
+                self._refill()
+                yield
+                return
+            with open(self.state_path, "a+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    try:
+                        state = json.loads(f.read())
+                        self.tokens, self.updated = float(state["tokens"]), float(state["updated"])
+                    except (ValueError, KeyError):
+                        # New or unreadable state file: start full
+                        self.tokens, self.updated = self.capacity, self._clock()
+                    self._refill()
+                    yield
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps({"tokens": self.tokens, "updated": self.updated}))
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def available(self) -> float:
+        with self._state():
+            return self.tokens
+
+    def try_take(self, tokens: float, reserve: float = 0.0) -> float:
+        """
+        Takes `tokens` if that leaves at least `reserve` in the bucket and returns 0.
+        Otherwise takes nothing and returns the seconds until it would succeed.
+        """
+        with self._state():
+            # Oversized requests go through once the bucket is as full as it can be for them
+            tokens = min(tokens, self.capacity - reserve)
+            if self.tokens - tokens >= reserve:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens + reserve - self.tokens) / self.rate
+
+class _Job:
+    def __init__(self, priority: int, estimated_tokens: int, fn=None, texts: list[str] = None):
+        self.priority = priority
+        self.estimated_tokens = estimated_tokens
+        self.fn = fn
+        self.texts = texts
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+class RequestScheduler:
+    """
+    Single front door for outbound OpenAI calls from this process.
+
+    Every request carries an estimated token cost and a priority class. A
+    dispatcher thread hands requests to a bounded pool of callers only when
+    the tokens-per-minute bucket can pay for them; interactive requests are
+    always picked before background ones, and background requests may not
+    dip into the last `interactive_reserve` fraction of the bucket nor take
+    the last `interactive_slots` callers, so chat keeps headroom in both
+    quota and concurrency while a bulk ingest is running. Queued embedding
+    requests of the same class are coalesced into batches of up to
+    `embed_batch_size` inputs before being sent through `embed_batch`.
+
+    Pass `state_path` to share the token bucket with the other processes of
+    the deployment (see TokenBucket); priorities and queues stay per process.
+    """
+    def __init__(self, embed_batch, tokens_per_minute: int = 240000, max_concurrency: int = 8,
+                 embed_batch_size: int = 16, interactive_reserve: float = 0.2, interactive_slots: int = 1,
+                 state_path: str = None):
+        self.embed_batch = embed_batch
+        self.bucket = TokenBucket(tokens_per_minute, state_path=state_path)
+        self.max_concurrency = max_concurrency
+        self.embed_batch_size = embed_batch_size
+        self.interactive_reserve = interactive_reserve
+        # A single-caller scheduler can't hold a slot back, or background work would never run
+        self.background_slots = max(1, max_concurrency - interactive_slots)
+
+        self._queues = {INTERACTIVE: deque(), BACKGROUND: deque()}
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._enqueued = 0  # bumped on every enqueue, so the dispatcher notices work that arrived while it wasn't waiting
+        self._closed = False
+        self._stats = {
+            p: {"dispatched": 0, "tokens": 0, "wait_seconds": 0.0} for p in PRIORITY_NAMES
+        }
+        self._embedding_batches = 0
+        self._embedding_inputs = 0
+
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="openai")
+        self._dispatcher = threading.Thread(target=self._run, name="openai-scheduler", daemon=True)
+        self._dispatcher.start()
+
+    # --- public API -----------------------------------------------------------
+
+    def submit(self, fn, estimated_tokens: int, priority: int = INTERACTIVE) -> Future:
+        """Runs `fn()` once the quota allows; the returned future holds its result."""
+        job = _Job(priority, estimated_tokens, fn=fn)
+        self._enqueue([job])
+        return job.future
+
+    def embed(self, texts: list[str], priority: int = BACKGROUND) -> Future:
+        """Embeds `texts`, possibly sharing requests with other callers. Resolves to a list of vectors."""
+        jobs = [
+            _Job(priority, sum(estimate_tokens(t) for t in part), texts=part)
+            for part in (texts[i:i + self.embed_batch_size] for i in range(0, len(texts), self.embed_batch_size))
+        ]
+        result = Future()
+        if not jobs:
+            result.set_result([])
+            return result
+
+        remaining = [len(jobs)]
+        lock = threading.Lock()
+
+        def on_done(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            if result.done():
+                return
+            for job in jobs:
+                if job.future.exception() is not None:
+                    result.set_exception(job.future.exception())
+                    return
+            result.set_result([vector for job in jobs for vector in job.future.result()])
+
+        for job in jobs:
+            job.future.add_done_callback(on_done)
+        self._enqueue(jobs)
+        return result
+
+    def metrics(self) -> dict:
+        # The shared bucket means a file lock, so read it before taking ours
+        tokens_available = int(self.bucket.available())
+        with self._cond:
+            return {
+                "queue_depth": {PRIORITY_NAMES[p]: len(q) for p, q in self._queues.items()},
+                "queued_tokens": {
+                    PRIORITY_NAMES[p]: sum(job.estimated_tokens for job in q) for p, q in self._queues.items()
+                },
+                "in_flight": self._in_flight,
+                "tokens_available": tokens_available,
+                "tokens_per_minute": int(self.bucket.capacity),
+                "dispatched": {PRIORITY_NAMES[p]: s["dispatched"] for p, s in self._stats.items()},
+                "dispatched_tokens": {PRIORITY_NAMES[p]: s["tokens"] for p, s in self._stats.items()},
+                "avg_queue_wait_ms": {
+                    PRIORITY_NAMES[p]: round(1000 * s["wait_seconds"] / s["dispatched"], 1) if s["dispatched"] else 0.0
+                    for p, s in self._stats.items()
+                },
+                "embedding_batches": self._embedding_batches,
+                "embedding_inputs": self._embedding_inputs,
+            }
+
+    def shutdown(self, wait: bool = True):
+        """Stops accepting work; queued requests are still sent before the dispatcher exits."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if wait:
+            self._dispatcher.join()
+            self._executor.shutdown(wait=True)
+
+    # --- dispatcher -----------------------------------------------------------
+
+    def _enqueue(self, jobs: list[_Job]):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("RequestScheduler is shut down")
+            for job in jobs:
+                self._queues[job.priority].append(job)
+            self._enqueued += 1
+            self._cond.notify_all()
+
+    def _next_batch(self, queue: deque) -> list[_Job]:
+        """The head job, plus any other queued embedding jobs that fit in the same request."""
+        head = queue[0]
+        if head.texts is None:
+            return [head]
+        batch = [head]
+        size = len(head.texts)
+        for job in itertools.islice(queue, 1, None):
+            if job.texts is not None and size + len(job.texts) <= self.embed_batch_size:
+                batch.append(job)
+                size += len(job.texts)
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                candidate = None
+                while candidate is None:
+                    priority = next((p for p in sorted(self._queues) if self._queues[p]), None)
+                    if priority is None:
+                        if self._closed:
+                            return
+                        self._cond.wait()
+                        continue
+
+                    # Only pick work once a caller is free for it; background can't take the reserved ones
+                    limit = self.max_concurrency if priority == INTERACTIVE else self.background_slots
+                    if self._in_flight >= limit:
+                        self._cond.wait()
+                        continue
+
+                    # Take the jobs out of the queue while the bucket is asked, which for a
+                    # shared bucket means waiting on other processes' file lock
+                    queue = self._queues[priority]
+                    candidate = self._next_batch(queue)
+                    for job in candidate:
+                        queue.remove(job)
+                    enqueued = self._enqueued
+
+            tokens = sum(job.estimated_tokens for job in candidate)
+            reserve = 0.0 if priority == INTERACTIVE else self.interactive_reserve * self.bucket.capacity
+            wait = self.bucket.try_take(tokens, reserve)
+
+            with self._cond:
+                if wait > 0:
+                    queue.extendleft(reversed(candidate))
+                    # Woken early by new work, so a fresh interactive request is re-considered
+                    if self._enqueued == enqueued:
+                        self._cond.wait(timeout=wait)
+                    continue
+
+                now = time.monotonic()
+                stats = self._stats[priority]
+                for job in candidate:
+                    stats["dispatched"] += 1
+                    stats["tokens"] += job.estimated_tokens
+                    stats["wait_seconds"] += now - job.enqueued_at
+                self._in_flight += 1
+            self._executor.submit(self._execute, candidate)
+
+    def _execute(self, batch: list[_Job]):
+        try:
+            if batch[0].texts is None:
+                job = batch[0]
+                try:
+                    job.future.set_result(job.fn())
+                except Exception as e:
+                    job.future.set_exception(e)
+                return
+
+            texts = [text for job in batch for text in job.texts]
+            try:
+                vectors = self.embed_batch(texts)
+            except Exception as e:
+                for job in batch:
+                    job.future.set_exception(e)
+                return
+            with self._cond:
+                self._embedding_batches += 1
+                self._embedding_inputs += len(texts)
+            start = 0
+            for job in batch:
+                job.future.set_result(vectors[start:start + len(job.texts)])
+                start += len(job.texts)
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+class ScheduledOpenAIClient:
+    """
+    Drop-in replacement for OpenAIClient that sends every call through a
+    RequestScheduler at a fixed priority. Calls block until their turn.
+    """
+    def __init__(self, openai_client, scheduler: RequestScheduler, priority: int = INTERACTIVE,
+                 max_completion_tokens: int = 1000):
+        self.openai_client = openai_client
+        self.scheduler = scheduler
+        self.priority = priority
+        self.max_completion_tokens = max_completion_tokens
+
+    def create_embedding(self, text: str):
+        return self.scheduler.embed([text], self.priority).result()[0]
+
+    def create_embeddings(self, texts: list[str]):
+        return self.scheduler.embed(texts, self.priority).result()
+
+    def generate_chat_completion(self, system_prompt: str, user_message: str):
+        tokens = estimate_tokens(system_prompt) + estimate_tokens(user_message) + self.max_completion_tokens
+        return self.scheduler.submit(
+            lambda: self.openai_client.generate_chat_completion(system_prompt, user_message),
+            tokens,
+            self.priority
+        ).result()
+
+    def stream_chat_completion(self, system_prompt: str, user_message: str):
+        tokens = estimate_tokens(system_prompt) + estimate_tokens(user_message) + self.max_completion_tokens
+
+        def start_stream():
+            # Pull the first chunk inside the scheduled call so the request is actually sent
+            stream = iter(self.openai_client.stream_chat_completion(system_prompt, user_message))
+            try:
+                first = next(stream)
+            except StopIteration:
+                return iter(())
+            return itertools.chain([first], stream)
+
+        yield from self.scheduler.submit(start_stream, tokens, self.priority).result()
+
+class SchedulerEmbeddings:
+    """LangChain-style embeddings (embed_documents / embed_query) backed by the scheduler."""
+    def __init__(self, scheduler: RequestScheduler, priority: int = BACKGROUND):
+        self.scheduler = scheduler
+        self.priority = priority
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.scheduler.embed(list(texts), self.priority).result()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.scheduler.embed([text], self.priority).result()[0]
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler() -> RequestScheduler:
+    """The process-wide scheduler, created on first use."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            import os
+            from .. import config
+            from .openai_client import OpenAIClient
+
+            state_path = None
+            if config.SCHEDULER_STATE_DIR:
+                os.makedirs(config.SCHEDULER_STATE_DIR, exist_ok=True)
+                state_path = os.path.join(config.SCHEDULER_STATE_DIR, "openai_quota.json")
+
+            _scheduler = RequestScheduler(
+                OpenAIClient(config).create_embeddings,
+                tokens_per_minute=config.OPENAI_TOKENS_PER_MINUTE,
+                max_concurrency=config.OPENAI_MAX_CONCURRENCY,
+                embed_batch_size=config.EMBED_BATCH_SIZE,
+                interactive_reserve=config.OPENAI_INTERACTIVE_RESERVE,
+                interactive_slots=config.OPENAI_INTERACTIVE_SLOTS,
+                state_path=state_path
+            )
+        return _scheduler
+
+def shutdown_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is not None:
+            _scheduler.shutdown()
+            _scheduler = None
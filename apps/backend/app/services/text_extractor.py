@@ -1,8 +1,9 @@
 # app/services/text_extractor.py
 
 import io
-import docx
-import pdfplumber
+
+# docx and pdfplumber are imported on first use so that processes which never
+# extract text (auth/chat only) don't pay for them at startup
 
 class BaseTextExtractor:
     def extract_text(self, file_bytes: bytes) -> str:
@@ -10,6 +11,8 @@ class BaseTextExtractor:
 
 class PDFTextExtractor(BaseTextExtractor):
     def extract_text(self, file_bytes: bytes) -> str:
+        import pdfplumber
+
         main_text = []
         with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
             for page in pdf.pages:
@@ -22,6 +25,8 @@ class PDFTextExtractor(BaseTextExtractor):
 
 class DOCXTextExtractor(BaseTextExtractor):
     def extract_text(self, file_bytes: bytes) -> str:
+        import docx
+
         text = []
         doc = docx.Document(io.BytesIO(file_bytes))
         for para in doc.paragraphs:
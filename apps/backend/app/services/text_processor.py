@@ -1,19 +1,24 @@
 # app/services/text_processor.py
 
-from langchain_experimental.text_splitter import SemanticChunker
-from langchain_openai import AzureOpenAIEmbeddings
-
 class TextProcessor:
     """
     Handles splitting of text into chunks using the `SemanticChunker`,
     or a fallback approach as needed.
     """
-    def __init__(self, config, threshold_type="percentile", threshold_amount=88.0):
-        self.embeddings = AzureOpenAIEmbeddings(
-            model="text-embedding-ada-002",
-            api_key=config.MODEL_API_KEY,
-            api_version=config.API_VERSION
-        )
+    def __init__(self, config, threshold_type="percentile", threshold_amount=88.0, embeddings=None):
+        # LangChain is heavy to import; only ingest paths ever construct a TextProcessor
+        from langchain_experimental.text_splitter import SemanticChunker
+
+        # `embeddings` lets callers route the chunker's sentence embeddings elsewhere (e.g. the scheduler)
+        if embeddings is None:
+            from langchain_openai import AzureOpenAIEmbeddings
+
+            embeddings = AzureOpenAIEmbeddings(
+                model="text-embedding-ada-002",
+                api_key=config.MODEL_API_KEY,
+                api_version=config.API_VERSION
+            )
+        self.embeddings = embeddings
         self.text_splitter = SemanticChunker(
             self.embeddings,
             breakpoint_threshold_type=threshold_type,
@@ -0,0 +1,72 @@
+# app/startup.py
+
+import importlib
+import logging
+import time
+
+# uvicorn configures this logger, so the report shows up next to its own startup lines
+logger = logging.getLogger("uvicorn.error")
+
+# Routers each process role serves. "api" never imports the ingest stack
+# (faiss, pdfplumber, docx, langchain); "ingest" only serves uploads.
+ROUTERS = {
+    "auth": "/auth",
+    "chat": "/chat",
+    "upload": "/upload",
+    "metrics": "/metrics",
+}
+ROLE_ROUTERS = {
+    "all": ("auth", "chat", "upload", "metrics"),
+    "api": ("auth", "chat", "metrics"),
+    "ingest": ("auth", "upload", "metrics"),
+}
+
+def _import(*modules):
+    def hook():
+        for name in modules:
+            importlib.import_module(name)
+    return hook
+
+# name -> callable, run at startup when listed in PREWARM
+PREWARM_HOOKS = {
+    "faiss": _import("faiss"),
+    "extractors": _import("pdfplumber", "docx"),
+    "chunker": _import("langchain_experimental.text_splitter", "langchain_openai"),
+    "openai": _import("openai"),
+}
+
+def register_prewarm_hook(name: str, hook):
+    PREWARM_HOOKS[name] = hook
+
+class StartupReport:
+    """Wall-clock time of each startup phase, logged once the app is ready."""
+    def __init__(self, role: str):
+        self.role = role
+        self.phases = []  # (name, seconds)
+
+    def timed(self, name: str, fn, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def as_dict(self) -> dict:
+        return {
+            "role": self.role,
+            "phases": [{"name": name, "ms": round(seconds * 1000, 1)} for name, seconds in self.phases],
+            "total_ms": round(sum(seconds for _, seconds in self.phases) * 1000, 1),
+        }
+
+    def log(self):
+        report = self.as_dict()
+        phases = ", ".join(f"{p['name']}={p['ms']}ms" for p in report["phases"])
+        logger.info("Startup (%s role) took %sms: %s", self.role, report["total_ms"], phases)
+
+def run_prewarm(report: StartupReport, names: list[str]):
+    for name in names:
+        hook = PREWARM_HOOKS.get(name)
+        if hook is None:
+            logger.warning("Unknown prewarm hook '%s', expected one of %s", name, sorted(PREWARM_HOOKS))
+            continue
+        report.timed(f"prewarm:{name}", hook)
@@ -0,0 +1,92 @@
+# benchmarks/quantization_benchmark.py
+#
+# Memory / latency / recall@k trade-off of the EmbeddingsManager index codes.
+#
+#   python -m benchmarks.quantization_benchmark --vectors corpus.npy [--queries queries.npy]
+#
+# `corpus.npy` is an (n, d) float array of chunk embeddings exported from a real
+# corpus; without --queries a sample of corpus vectors plus a little noise is used.
+# Ground truth is exact inner-product search over the full-precision vectors.
+# The corpus is replayed as uploads of --upload-size chunks, with compaction and
+# retraining running between them, so the codes are trained the way production
+# trains them rather than once over the whole corpus.
+
+import argparse
+import time
+
+import numpy as np
+import faiss
+
+from app.services.embeddings_manager import EmbeddingsManager, QUANTIZATIONS, normalize_embeddings
+
+USER_ID = "bench"
+
+class ReplayManager(EmbeddingsManager):
+    """Runs background compaction inline, so every replay trains at the same points."""
+    def _schedule_compaction(self, user_id: str):
+        self.compact_user_index(user_id)
+
+def index_bytes(manager: EmbeddingsManager) -> int:
+    return sum(int(faiss.serialize_index(segment.faiss_index).size)
+               for segment in manager.user_indices[USER_ID]["segments"])
+
+def run(corpus: np.ndarray, queries: np.ndarray, k: int, rerank_factor: int, pq_m: int, upload_size: int):
+    corpus = normalize_embeddings(corpus.astype('float32'))
+    queries = normalize_embeddings(queries.astype('float32'))
+
+    exact = faiss.IndexFlatIP(corpus.shape[1])
+    exact.add(corpus)
+    _, truth = exact.search(queries, k)
+
+    configs = [(q, 0) for q in QUANTIZATIONS]
+    if rerank_factor:
+        configs += [(q, rerank_factor) for q in QUANTIZATIONS if q != "flat"]
+
+    print(f"{len(corpus)} vectors, d={corpus.shape[1]}, {len(queries)} queries, k={k}, uploads of {upload_size}")
+    print(f"{'codes':<8}{'rerank':>8}{'trained on':>12}{'index MB':>12}{'p50 ms':>10}{'p99 ms':>10}{'recall@k':>10}")
+    for quantization, factor in configs:
+        manager = ReplayManager(quantization=quantization, rerank_factor=factor, pq_m=pq_m)
+        for start in range(0, len(corpus), upload_size):
+            batch = corpus[start:start + upload_size]
+            manager.add_embeddings_for_user(USER_ID, batch, [""] * len(batch))
+
+        latencies = []
+        recall = 0.0
+        for q, expected in zip(queries, truth):
+            start = time.perf_counter()
+            hits = manager.search_user_ids(USER_ID, q, k=k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            recall += len({cid for cid, _ in hits} & set(expected.tolist())) / k
+
+        user_data = manager.user_indices[USER_ID]
+        print(f"{user_data['quantization']:<8}{factor:>8}{user_data['trained_on']:>12}"
+              f"{index_bytes(manager) / 2**20:>12.1f}"
+              f"{np.percentile(latencies, 50):>10.2f}{np.percentile(latencies, 99):>10.2f}"
+              f"{recall / len(queries):>10.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--vectors", help="(n, d) .npy corpus of embeddings; random if omitted")
+    parser.add_argument("--queries", help="(m, d) .npy query embeddings")
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--rerank-factor", type=int, default=4)
+    parser.add_argument("--pq-m", type=int, default=96)
+    parser.add_argument("--upload-size", type=int, default=200, help="chunks per replayed upload")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.vectors:
+        corpus = np.load(args.vectors)
+    else:
+        corpus = rng.standard_normal((20000, 1536)).astype('float32')
+    if args.queries:
+        queries = np.load(args.queries)
+    else:
+        sample = corpus[rng.choice(len(corpus), args.num_queries, replace=False)]
+        queries = sample + 0.1 * rng.standard_normal(sample.shape).astype('float32') * np.abs(sample).mean()
+
+    run(corpus, queries, args.k, args.rerank_factor, args.pq_m, args.upload_size)
+
+if __name__ == "__main__":
+    main()
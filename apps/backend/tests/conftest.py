@@ -45,4 +45,16 @@ def client(db_session):
             pass
 
     app.dependency_overrides[get_db] = _get_test_db
-    return TestClient(app)
\ No newline at end of file
+    return TestClient(app)
+
+@pytest.fixture
+def auth_headers(client: TestClient):
+    """
+    Logs in the user we created in test_auth and returns a dict of headers
+    with the Bearer token. Adjust credentials if needed.
+    """
+    data = {"username": "test@example.com", "password": "secret123"}
+    response = client.post("/auth/login", data=data)
+    assert response.status_code == 200
+    token = response.json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
@@ -3,18 +3,6 @@
 import pytest
 from fastapi.testclient import TestClient
 
-@pytest.fixture
-def auth_headers(client: TestClient):
-    """
-    Logs in the user we created in test_auth and returns a dict of headers
-    with the Bearer token. Adjust credentials if needed.
-    """
-    data = {"username": "test@example.com", "password": "secret123"}
-    response = client.post("/auth/login", data=data)
-    assert response.status_code == 200
-    token = response.json()["access_token"]
-    return {"Authorization": f"Bearer {token}"}
-
 def test_start_chat(client: TestClient, auth_headers):
     payload = {"session_name": "My First Chat Session"}
     response = client.post("/chat/start_chat", json=payload, headers=auth_headers)
@@ -59,4 +47,28 @@ def test_get_chat_messages(client: TestClient, auth_headers):
     assert len(data) >= 2
     roles = [msg["role"] for msg in data]
     assert "user" in roles
-    assert "assistant" in roles
\ No newline at end of file
+    assert "assistant" in roles
+
+def test_search_chat_history(client: TestClient, auth_headers, db_session):
+    from app.models.chat_message import ChatMessage
+
+    start = client.post("/chat/start_chat", params={"session_name": "Search me"}, headers=auth_headers)
+    assert start.status_code == 200
+    session_id = start.json()["session_id"]
+    db_session.add_all([
+        ChatMessage(session_id=session_id, role="user", content="How do I rebuild a quantized index?"),
+        ChatMessage(session_id=session_id, role="assistant", content="Retrain the codes on the live vectors."),
+    ])
+    db_session.commit()
+
+    response = client.get("/chat/search", params={"q": "quantized index"}, headers=auth_headers)
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert len(results) == 1
+    assert results[0]["session_id"] == session_id
+    assert results[0]["role"] == "user"
+    assert "[quantized]" in results[0]["snippet"]
+
+    # FTS syntax in user input is treated as plain text
+    response = client.get("/chat/search", params={"q": 'index" OR (AND'}, headers=auth_headers)
+    assert response.status_code == 200
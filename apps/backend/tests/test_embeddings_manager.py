@@ -0,0 +1,119 @@
+# tests/test_embeddings_manager.py
+
+import os
+
+import numpy as np
+from app.services.embeddings_manager import EmbeddingsManager, MAX_SEGMENTS, RETRAIN_GROWTH
+
+def vector_count(manager: EmbeddingsManager, user_id: str) -> int:
+    return sum(segment.faiss_index.ntotal for segment in manager.user_indices[user_id]["segments"])
+
+def test_workers_share_index_dir(tmp_path):
+    # Two managers on one directory stand in for two uvicorn workers
+    worker_a = EmbeddingsManager(index_dir=str(tmp_path))
+    worker_b = EmbeddingsManager(index_dir=str(tmp_path))
+
+    worker_a.add_embeddings_for_user("1", np.array([[1.0, 0.0], [0.0, 1.0]]), ["alpha", "beta"])
+    assert worker_b.search_user_index("1", [1.0, 0.1], k=1) == "alpha"
+
+    # Writes from the second worker build on the first one's data
+    worker_b.add_embeddings_for_user("1", np.array([[-1.0, 0.0]]), ["gamma"])
+    assert worker_a.search_user_index("1", [-1.0, 0.0], k=1) == "gamma"
+    assert worker_a.search_user_index("1", [0.0, 1.0], k=1) == "beta"
+
+def test_delete_document_tombstones_and_compacts(tmp_path):
+    manager = EmbeddingsManager(index_dir=str(tmp_path), compact_threshold=0.9)
+    manager.add_embeddings_for_user("1", np.array([[1.0, 0.0], [0.9, 0.1]]), ["a1", "a2"], document_id=10)
+    manager.add_embeddings_for_user("1", np.array([[0.0, 1.0]]), ["b1"], document_id=11)
+
+    assert manager.delete_document_for_user("1", 10) == 2
+    # Tombstoned chunks never come back, even when they are the closest match
+    assert manager.search_user_index("1", [1.0, 0.0], k=2) == "b1"
+    assert vector_count(manager, "1") == 3
+
+    manager.compact_user_index("1")
+    assert vector_count(manager, "1") == 1
+    assert manager.deleted_fraction("1") == 0.0
+    assert manager.search_user_index("1", [1.0, 0.0], k=2) == "b1"
+
+    # Other workers pick up the compacted version
+    other = EmbeddingsManager(index_dir=str(tmp_path))
+    assert other.search_user_index("1", [0.0, 1.0], k=5) == "b1"
+
+def test_delete_unknown_document(tmp_path):
+    manager = EmbeddingsManager(index_dir=str(tmp_path))
+    assert manager.delete_document_for_user("1", 42) == 0
+
+def test_quantized_index_rerank(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((300, 16)).astype('float32')
+    manager = EmbeddingsManager(index_dir=str(tmp_path), quantization="int8", rerank_factor=4)
+
+    # Too few vectors to train int8 codes: starts as fp16
+    manager.add_embeddings_for_user("1", vectors[:10], [f"c{i}" for i in range(10)])
+    assert manager.user_indices["1"]["quantization"] == "fp16"
+
+    manager.add_embeddings_for_user("1", vectors[10:], [f"c{i}" for i in range(10, 300)])
+    # Retraining runs in the background; run it here so the test doesn't race it
+    manager.compact_user_index("1")
+    assert manager.user_indices["1"]["quantization"] == "int8"
+
+    hits = manager.search_user_ids("1", vectors[123], k=3)
+    assert hits[0][0] == 123
+    assert hits[0][1] >= hits[1][1] >= hits[2][1]
+
+def test_codes_retrain_as_the_corpus_grows(tmp_path):
+    rng = np.random.default_rng(0)
+    manager = EmbeddingsManager(index_dir=str(tmp_path), quantization="int8")
+    manager.add_embeddings_for_user("1", rng.standard_normal((300, 16)), ["c"] * 300)
+    assert manager.user_indices["1"]["trained_on"] == 300
+
+    # Still within the growth factor: the codes are kept
+    manager.add_embeddings_for_user("1", rng.standard_normal((100, 16)), ["c"] * 100)
+    manager.compact_user_index("1")
+    assert manager.user_indices["1"]["trained_on"] == 300
+
+    grow = int(300 * RETRAIN_GROWTH) - 400
+    manager.add_embeddings_for_user("1", rng.standard_normal((grow, 16)), ["c"] * grow)
+    manager.compact_user_index("1")
+    assert manager.user_indices["1"]["trained_on"] == 300 * RETRAIN_GROWTH
+
+def test_pq_waits_for_enough_training_vectors(tmp_path):
+    rng = np.random.default_rng(0)
+    manager = EmbeddingsManager(index_dir=str(tmp_path), quantization="pq", pq_m=4)
+    # Enough for int8, far too few for 256 PQ centroids per sub-quantizer
+    manager.add_embeddings_for_user("1", rng.standard_normal((1000, 16)), ["c"] * 1000)
+    manager.compact_user_index("1")
+    assert manager.user_indices["1"]["quantization"] == "fp16"
+
+def test_uploads_publish_segments(tmp_path):
+    index_dir = tmp_path / "indices"
+    writer = EmbeddingsManager(index_dir=str(index_dir), compact_threshold=1.0)
+    reader = EmbeddingsManager(index_dir=str(index_dir))
+    # Nothing touches the disk until the first write
+    assert not index_dir.exists()
+
+    writer.add_embeddings_for_user("1", np.array([[1.0, 0.0]]), ["a"], document_id=1)
+    assert reader.search_user_index("1", [1.0, 0.0], k=1) == "a"
+    first = reader.user_indices["1"]["segments"][0]
+
+    writer.add_embeddings_for_user("1", np.array([[0.0, 1.0]]), ["b"], document_id=2)
+    assert reader.search_user_index("1", [0.0, 1.0], k=1) == "b"
+    # The reader only loaded the new segment
+    assert reader.user_indices["1"]["segments"][0] is first
+    assert len(reader.user_indices["1"]["segments"]) == 2
+
+    # A delete publishes a manifest and no segment
+    writer.delete_document_for_user("1", 1)
+    assert sorted(os.listdir(index_dir / "1" / "segments")) == ["s1", "s2"]
+
+def test_segments_are_merged(tmp_path):
+    manager = EmbeddingsManager(index_dir=str(tmp_path))
+    for i in range(MAX_SEGMENTS + 1):
+        manager.add_embeddings_for_user("1", np.array([[1.0, float(i)]]), [f"c{i}"])
+
+    manager.compact_user_index("1")
+    assert len(manager.user_indices["1"]["segments"]) <= MAX_SEGMENTS
+    assert vector_count(manager, "1") == MAX_SEGMENTS + 1
+    other = EmbeddingsManager(index_dir=str(tmp_path))
+    assert other.search_user_index("1", [0.0, 1.0], k=1) == f"c{MAX_SEGMENTS}"
@@ -0,0 +1,93 @@
+# tests/test_message_log.py
+
+import json
+from sqlalchemy.exc import IntegrityError, OperationalError
+from app.database import SessionLocal
+from app.models.chat_session import ChatSession
+from app.models.chat_message import ChatMessage
+from app.services.message_log import MessageLog
+
+def test_pending_messages_are_visible_then_flushed_in_order(db_session):
+    chat_session = ChatSession(user_id=1, session_name="write-behind")
+    db_session.add(chat_session)
+    db_session.commit()
+
+    # Long interval and large batch, so nothing is written until we ask
+    log = MessageLog(SessionLocal, flush_interval=60, max_batch=1000)
+    for i in range(3):
+        log.append(chat_session.id, "user" if i % 2 == 0 else "assistant", f"message {i}")
+
+    pending = log.pending_for_session(chat_session.id)
+    assert [m.content for m in pending] == ["message 0", "message 1", "message 2"]
+    assert pending[0].timestamp < pending[1].timestamp < pending[2].timestamp
+
+    log.close()
+    assert log.pending_for_session(chat_session.id) == []
+    stored = db_session.query(ChatMessage).filter(
+        ChatMessage.session_id == chat_session.id
+    ).order_by(ChatMessage.timestamp).all()
+    assert [m.content for m in stored] == ["message 0", "message 1", "message 2"]
+
+def test_flush_on_batch_size(db_session):
+    chat_session = ChatSession(user_id=1, session_name="batch size")
+    db_session.add(chat_session)
+    db_session.commit()
+
+    log = MessageLog(SessionLocal, flush_interval=60, max_batch=2)
+    log.append(chat_session.id, "user", "a")
+    log.append(chat_session.id, "assistant", "b")
+    assert log.flush(timeout=5)
+    assert db_session.query(ChatMessage).filter(ChatMessage.session_id == chat_session.id).count() == 2
+    assert log.close()
+
+def test_rejected_message_goes_to_dead_letters(db_session, monkeypatch, tmp_path):
+    chat_session = ChatSession(user_id=1, session_name="dead letters")
+    db_session.add(chat_session)
+    db_session.commit()
+
+    dead_letter_path = tmp_path / "dead_letters.jsonl"
+    log = MessageLog(SessionLocal, flush_interval=0.01, max_batch=100, dead_letter_path=str(dead_letter_path))
+    write = log._write
+
+    def flaky_write(batch):
+        # Stands in for a deleted session's foreign key
+        if any(m.content == "poison" for m in batch):
+            raise IntegrityError("INSERT INTO chat_messages", {}, Exception("FOREIGN KEY constraint failed"))
+        write(batch)
+
+    monkeypatch.setattr(log, "_write", flaky_write)
+    log.append(chat_session.id, "user", "before")
+    log.append(chat_session.id, "user", "poison")
+    log.append(chat_session.id, "assistant", "after")
+    assert log.close(timeout=5)
+
+    assert [m.content for m in log.dead_letters] == ["poison"]
+    assert [json.loads(line)["content"] for line in dead_letter_path.read_text().splitlines()] == ["poison"]
+    assert log.metrics()["dead_letters"] == 1
+    stored = db_session.query(ChatMessage).filter(
+        ChatMessage.session_id == chat_session.id
+    ).order_by(ChatMessage.timestamp).all()
+    assert [m.content for m in stored] == ["before", "after"]
+
+def test_transient_errors_are_retried(db_session, monkeypatch):
+    chat_session = ChatSession(user_id=1, session_name="transient")
+    db_session.add(chat_session)
+    db_session.commit()
+
+    log = MessageLog(SessionLocal, flush_interval=0.01, max_batch=100)
+    write = log._write
+    failures = [OperationalError("INSERT INTO chat_messages", {}, Exception("database is locked"))] * 3
+
+    def locked_write(batch):
+        if failures:
+            raise failures.pop()
+        write(batch)
+
+    monkeypatch.setattr(log, "_write", locked_write)
+    message = log.append(chat_session.id, "user", "survives")
+    assert log.wait_until_written(message, timeout=10)
+    assert log.close()
+
+    assert list(log.dead_letters) == []
+    stored = db_session.query(ChatMessage).filter(ChatMessage.session_id == chat_session.id).all()
+    assert [m.content for m in stored] == ["survives"]
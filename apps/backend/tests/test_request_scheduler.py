@@ -0,0 +1,95 @@
+# tests/test_request_scheduler.py
+
+import fcntl
+import threading
+from app.services.request_scheduler import RequestScheduler, TokenBucket, INTERACTIVE, BACKGROUND
+
+def _blocked_scheduler(embed_batch=None, **kwargs):
+    """A single-caller scheduler whose caller is busy until the returned event is set."""
+    scheduler = RequestScheduler(embed_batch or (lambda texts: [[float(len(t))] for t in texts]),
+                                 max_concurrency=1, **kwargs)
+    started, release = threading.Event(), threading.Event()
+
+    def busy():
+        started.set()
+        release.wait()
+
+    scheduler.submit(busy, 1, INTERACTIVE)
+    started.wait()
+    return scheduler, release
+
+def test_embedding_requests_are_coalesced():
+    calls = []
+
+    def embed_batch(texts):
+        calls.append(list(texts))
+        return [[float(len(t))] for t in texts]
+
+    scheduler, release = _blocked_scheduler(embed_batch, embed_batch_size=16)
+    futures = [scheduler.embed(["a" * i, "b" * i], BACKGROUND) for i in range(1, 4)]
+    release.set()
+
+    assert [f.result(timeout=5) for f in futures] == [[[1.0], [1.0]], [[2.0], [2.0]], [[3.0], [3.0]]]
+    assert calls == [["a", "b", "aa", "bb", "aaa", "bbb"]]
+    assert scheduler.metrics()["embedding_batches"] == 1
+    scheduler.shutdown()
+
+def test_interactive_runs_before_background():
+    order = []
+    scheduler, release = _blocked_scheduler()
+    background = scheduler.submit(lambda: order.append("ingest"), 10, BACKGROUND)
+    interactive = scheduler.submit(lambda: order.append("chat"), 10, INTERACTIVE)
+    assert scheduler.metrics()["queue_depth"] == {"interactive": 1, "background": 1}
+    release.set()
+
+    background.result(timeout=5)
+    interactive.result(timeout=5)
+    assert order == ["chat", "ingest"]
+    scheduler.shutdown()
+
+def test_token_bucket_keeps_interactive_reserve():
+    bucket = TokenBucket(tokens_per_minute=600)
+    assert bucket.try_take(400, reserve=120) == 0.0
+    # 200 left: background can't take 100 without dipping into the reserve, interactive can
+    assert bucket.try_take(100, reserve=120) > 0
+    assert bucket.try_take(100) == 0.0
+
+def test_background_leaves_a_slot_for_interactive():
+    scheduler = RequestScheduler(lambda texts: [], max_concurrency=2, interactive_slots=1)
+    started, release = threading.Event(), threading.Event()
+
+    def busy():
+        started.set()
+        release.wait()
+
+    scheduler.submit(busy, 1, BACKGROUND)
+    started.wait()
+    queued = scheduler.submit(lambda: "ingest", 1, BACKGROUND)
+    # The second caller is reserved, so chat gets it while the ingest call is still running
+    assert scheduler.submit(lambda: "chat", 1, INTERACTIVE).result(timeout=5) == "chat"
+    assert not queued.done()
+
+    release.set()
+    assert queued.result(timeout=5) == "ingest"
+    scheduler.shutdown()
+
+def test_token_bucket_shared_between_processes(tmp_path):
+    state_path = str(tmp_path / "quota.json")
+    # Two buckets on one state file stand in for two worker processes
+    api, ingest = TokenBucket(600, state_path=state_path), TokenBucket(600, state_path=state_path)
+    assert api.try_take(500) == 0.0
+    assert ingest.try_take(500) > 0
+    assert ingest.available() < 110
+
+def test_submit_does_not_wait_on_the_shared_bucket_lock(tmp_path):
+    state_path = str(tmp_path / "quota.json")
+    scheduler = RequestScheduler(lambda texts: [], state_path=state_path)
+    # Another process is holding the bucket's file lock
+    with open(state_path, "a+") as other_process:
+        fcntl.flock(other_process, fcntl.LOCK_EX)
+        scheduler.submit(lambda: None, 1, BACKGROUND)
+        submitted = threading.Event()
+        threading.Thread(target=lambda: (scheduler.submit(lambda: None, 1, INTERACTIVE), submitted.set())).start()
+        assert submitted.wait(timeout=1)
+        fcntl.flock(other_process, fcntl.LOCK_UN)
+    scheduler.shutdown()
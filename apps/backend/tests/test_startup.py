@@ -0,0 +1,32 @@
+# tests/test_startup.py
+
+import pytest
+from fastapi.testclient import TestClient
+from app.main import create_app
+
+def test_ingest_role_only_serves_uploads():
+    app = create_app(role="ingest")
+    paths = {route.path for route in app.routes}
+    assert "/upload/" in paths
+    assert "/auth/login" in paths
+    assert "/chat/sessions" not in paths
+
+def test_startup_report():
+    with TestClient(create_app(role="ingest")) as client:
+        response = client.get("/startup_report")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["role"] == "ingest"
+    names = [p["name"] for p in data["phases"]]
+    assert "router:upload" in names
+    assert "create_all" in names
+
+def test_unknown_role():
+    with pytest.raises(ValueError):
+        create_app(role="bogus")
+
+def test_api_role_skips_ingest():
+    app = create_app(role="api")
+    paths = {route.path for route in app.routes}
+    assert "/chat/sessions" in paths
+    assert "/upload/" not in paths
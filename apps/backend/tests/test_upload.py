@@ -2,6 +2,42 @@
 
 from fastapi.testclient import TestClient
 import io
+import zipfile
+import numpy as np
+from app.database import SessionLocal
+from app.models.document import Document
+from app.services.embeddings_manager import EmbeddingsManager
+from app.services.file_service import FileService
+
+class WriterCheckingIngest:
+    """Stands in for the FileService and writes through another session while "embedding"."""
+    def write_elsewhere(self):
+        # Blocks, then fails with "database is locked", if the request holds a write transaction
+        other = SessionLocal()
+        try:
+            other.add(Document(filename="concurrent-writer.txt"))
+            other.commit()
+        finally:
+            other.close()
+
+    def embed_file(self, file_bytes, file_name):
+        self.write_elsewhere()
+        return ["chunk"], np.array([[1.0, 0.0]])
+
+    def embed_files(self, files, batch_size=16):
+        self.write_elsewhere()
+        return [(["chunk"], np.array([[1.0, 0.0]])) for _ in files]
+
+class OfflineEmbeddings:
+    """Deterministic vectors for both the chunker and the chunk embeddings, so no OpenAI call is made."""
+    def embed_documents(self, texts):
+        return [[1.0, float(len(t))] for t in texts]
+
+    def embed_query(self, text):
+        return [1.0, float(len(text))]
+
+    def create_embeddings(self, texts):
+        return self.embed_documents(texts)
 
 def test_upload_document(client: TestClient, auth_headers):
     # We'll upload a fake text file in memory
@@ -13,4 +49,77 @@ def test_upload_document(client: TestClient, auth_headers):
     assert response.status_code == 200
     data = response.json()
     assert data["msg"] == "File uploaded"
-    assert "document_id" in data
\ No newline at end of file
+    assert "document_id" in data
+
+def test_upload_embeds_before_taking_the_write_lock(client: TestClient, auth_headers, monkeypatch, tmp_path):
+    from app.routers import upload
+
+    monkeypatch.setattr(upload, "_ingest_file_service", WriterCheckingIngest)
+    monkeypatch.setattr(upload, "embeddings_manager", EmbeddingsManager(index_dir=str(tmp_path)))
+    files = {"file": ("test.txt", b"Hello from a test file.", "text/plain")}
+    response = client.post("/upload/", files=files, headers=auth_headers)
+    assert response.status_code == 200
+
+def test_upload_documents_bulk(client: TestClient, auth_headers):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("notes/a.txt", "First file in the archive.")
+        zf.writestr("notes/b.txt", "Second file in the archive.")
+        zf.writestr("__MACOSX/notes/._a.txt", "resource fork")
+    files = [
+        ("files", ("kb.zip", archive.getvalue(), "application/zip")),
+        ("files", ("c.txt", b"A loose text file.", "text/plain")),
+    ]
+    response = client.post("/upload/bulk", files=files, headers=auth_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["document_ids"]) == 3
+
+def test_upload_documents_bulk_bad_zip(client: TestClient, auth_headers):
+    files = [("files", ("broken.zip", b"not a zip", "application/zip"))]
+    response = client.post("/upload/bulk", files=files, headers=auth_headers)
+    assert response.status_code == 400
+
+def test_upload_documents_bulk_too_many_files(client: TestClient, auth_headers, monkeypatch):
+    from app.routers import upload
+
+    monkeypatch.setattr(upload, "UPLOAD_MAX_FILES", 2)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        for i in range(3):
+            zf.writestr(f"{i}.txt", "x")
+    files = [("files", ("many.zip", archive.getvalue(), "application/zip"))]
+    response = client.post("/upload/bulk", files=files, headers=auth_headers)
+    assert response.status_code == 413
+
+def test_upload_documents_bulk_embeds_before_taking_the_write_lock(client: TestClient, auth_headers, monkeypatch, tmp_path):
+    from app.routers import upload
+
+    monkeypatch.setattr(upload, "_ingest_file_service", WriterCheckingIngest)
+    monkeypatch.setattr(upload, "embeddings_manager", EmbeddingsManager(index_dir=str(tmp_path)))
+    files = [("files", ("a.txt", b"First.", "text/plain")), ("files", ("b.txt", b"Second.", "text/plain"))]
+    response = client.post("/upload/bulk", files=files, headers=auth_headers)
+    assert response.status_code == 200
+    assert len(response.json()["document_ids"]) == 2
+
+def test_upload_documents_bulk_skips_unreadable_files(client: TestClient, auth_headers, monkeypatch, tmp_path):
+    from app.routers import upload
+
+    manager = EmbeddingsManager(index_dir=str(tmp_path))
+    offline = OfflineEmbeddings()
+    monkeypatch.setattr(upload, "embeddings_manager", manager)
+    monkeypatch.setattr(upload, "_ingest_file_service",
+                        lambda: FileService(offline, upload.model_config, manager, embeddings=offline))
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("kb/a.txt", "A readable file.")
+        zf.writestr("kb/logo.png", b"\x89PNG\r\n")
+        zf.writestr("kb/nested.zip", b"PK")
+        zf.writestr("kb/latin1.txt", "caf\xe9".encode("latin-1"))
+    files = [("files", ("kb.zip", archive.getvalue(), "application/zip"))]
+    response = client.post("/upload/bulk", files=files, headers=auth_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["document_ids"]) == 1
+    assert sorted(data["skipped"]) == ["logo.png", "nested.zip"]
+    assert data["failed"] == ["latin1.txt"]